@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Dispatch throughput benchmark
+
+Drives a synthetic stream of onMessage and onReactionAdded events
+through Bot._fbchat_callback_handler, with a fake fbchat client,
+and prints the results as JSON.
+
+Example:
+    python benchmarks/dispatch.py --events 20000 --commands 500 --reactions 1000
+    python benchmarks/dispatch.py --replay events.jsonl.gz
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import stibium # pylint: disable=wrong-import-position
+from stibium import contrib # pylint: disable=wrong-import-position
+from stibium.dataclasses import Thread, Message, Reaction, MessageReaction # pylint: disable=wrong-import-position
+from stibium.handlers import CommandHandler, ReactionHandler # pylint: disable=wrong-import-position
+from stibium.eventlog import read_events # pylint: disable=wrong-import-position
+from stibium._fbclient import EVENTS # pylint: disable=wrong-import-position
+
+from fakeclient import FakeClient, message_kwargs, reaction_kwargs # pylint: disable=wrong-import-position
+
+CONTRIB = ('echo', 'pins', 'permissions', 'forward')
+
+
+class BenchBot(stibium.Bot):
+    """Bot measuring how long dispatching every event takes"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+    def _dispatch(self, func, thread, event):
+        start = time.perf_counter()
+        super()._dispatch(func, thread, event)
+        self.latencies.append(time.perf_counter() - start)
+
+
+def _noop(event, bot):
+    pass
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def register_handlers(bot, args, tmpdir):
+    """Register the synthetic and contrib handlers, returns the number registered"""
+    handlers = [CommandHandler(_noop, f'cmd{i}') for i in range(args.commands)]
+    handlers += [ReactionHandler(_noop, f'mid.$target{i}') for i in range(args.reactions)]
+    mix = args.mix.split(',') if args.mix else []
+    if 'echo' in mix:
+        echo = contrib.EchoCommand()
+        if 'permissions' in mix:
+            db_file = os.path.join(tmpdir, 'permissions.json')
+            permissions = contrib.Permissions(db_file, admin='1')
+            permissions.block('blocked', echo)
+            handlers.append(permissions.handler())
+        handlers.append(echo)
+    if 'pins' in mix:
+        handlers += contrib.Pins(os.path.join(tmpdir, 'pins.db')).handlers()
+    if 'forward' in mix:
+        handlers += contrib.Forward('2000', '3000').handlers()
+    bot.register(*handlers)
+    return len(handlers)
+
+
+def make_events(bot, args, rng):
+    """Generate (func, thread, event) tuples"""
+    commands = [f'cmd{i}' for i in range(args.commands)]
+    mix = args.mix.split(',') if args.mix else []
+    if 'echo' in mix:
+        commands.append('echo')
+    if 'pins' in mix:
+        commands += ['pin', 'list']
+    if 'forward' in mix:
+        commands += ['send', 'respond']
+    threads = [str(2000 + i) for i in range(args.threads)]
+    events = []
+    for i in range(args.events):
+        thread_id = rng.choice(threads)
+        author = str(1000 + rng.randrange(50))
+        if rng.random() < args.reaction_ratio:
+            target = rng.randrange(args.reactions * 2) if args.reactions else 0
+            kwargs = reaction_kwargs(
+                f'mid.$target{target}', MessageReaction.YES, author, thread_id
+            )
+            events.append(('onReactionAdded', kwargs))
+            continue
+        if commands and rng.random() < args.command_ratio:
+            text = f'{bot.prefix}{rng.choice(commands)} argument {i}'
+        else:
+            text = f'plain message {i}'
+        events.append(('onMessage', message_kwargs(f'mid.$in{i}', text, author, thread_id)))
+    out = []
+    for func, kwargs in events:
+        if func == 'onMessage':
+            event = Message.fromkwargs(kwargs, bot)
+        else:
+            event = Reaction.fromkwargs(kwargs, bot)
+        out.append((func, Thread.fromkwargs(kwargs), event))
+    return out
+
+
+def load_events(bot, path):
+    """Load (func, thread, event) tuples from a recorded event log"""
+    return [
+        (func, Thread.fromkwargs(kwargs), EVENTS[func](kwargs, bot))
+        for _, func, kwargs in read_events(path) if func in EVENTS
+    ]
+
+
+def run(args):
+    logging.getLogger('stibium').setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # synthetic reactions repeat, they'd be dropped as duplicates
+        bot = BenchBot('bench', '%', (), None, workers=args.workers, dedup_size=0)
+        bot.fbchat_client = FakeClient(latency=args.latency / 1000)
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        registered = register_handlers(bot, args, tmpdir)
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        if args.replay:
+            events = load_events(bot, args.replay)
+        else:
+            events = make_events(bot, args, rng)
+        start = time.perf_counter()
+        for func, thread, event in events:
+            bot._fbchat_callback_handler(func, thread, event)
+        if args.workers:
+            bot._executor.join()
+        elapsed = time.perf_counter() - start
+
+    latencies = bot.latencies
+    p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+    return {
+        'benchmark': 'dispatch',
+        'stibium_version': stibium.__version__,
+        'python': sys.version.split()[0],
+        'config': vars(args),
+        'handlers': registered,
+        'events': len(events),
+        'dispatched': len(latencies),
+        'elapsed_s': elapsed,
+        'events_per_s': len(latencies) / elapsed if elapsed else None,
+        'latency_p50_us': p50 * 1e6 if p50 is not None else None,
+        'latency_p99_us': p99 * 1e6 if p99 is not None else None,
+        'memory_per_handler_bytes': (after - before) / registered if registered else None,
+        'messages_sent': bot.fbchat_client.sent,
+        'client_calls': bot.fbchat_client.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--commands', type=int, default=100, help='synthetic commands to register')
+    parser.add_argument('--reactions', type=int, default=100, help='synthetic reaction handlers to register')
+    parser.add_argument('--mix', default=','.join(CONTRIB), help='contrib handlers to register: ' + ','.join(CONTRIB))
+    parser.add_argument('--threads', type=int, default=20, help='number of conversations')
+    parser.add_argument('--command-ratio', type=float, default=0.5)
+    parser.add_argument('--reaction-ratio', type=float, default=0.2)
+    parser.add_argument('--workers', type=int, default=0, help='0 dispatches inline')
+    parser.add_argument('--latency', type=float, default=0, help='fake network latency in ms')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replay', help='use events from a recorded log (see stibium.eventlog)')
+    parser.add_argument('--output', help='write the JSON result to a file instead of stdout')
+    args = parser.parse_args()
+    result = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(result + '\n')
+    else:
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""In-process stand-in for fbchat.Client, used by the benchmarks"""
+
+import itertools
+import time
+
+from fbchat import models
+
+
+class _User(object):
+    def __init__(self, uid):
+        self.uid = uid
+        self.name = f'User {uid}'
+
+
+class _Group(object):
+    def __init__(self, participants):
+        self.participants = set(participants)
+
+
+class FakeClient(object):
+    """
+    Fake fbchat client
+
+    It implements the parts of fbchat.Client used by Stibium,
+    without any network access. Sent messages are stored,
+    so they can be fetched back. `latency` (in seconds) is added
+    to every call, to simulate the network.
+    """
+    def __init__(self, uid='100000000000000', latency=0, group_size=50):
+        self.uid = uid
+        self.latency = latency
+        self.group_size = group_size
+        self.sent = 0
+        self.calls = 0
+        self._messages = {}
+        self._mids = itertools.count()
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def send(self, message, thread_id=None, thread_type=None):
+        self._call()
+        self.sent += 1
+        mid = f'mid.$fake{next(self._mids)}'
+        message.uid = mid
+        message.author = self.uid
+        message.timestamp = str(int(time.time()*1000))
+        message.reactions = {}
+        message.replied_to = None
+        self._messages[mid] = message
+        return mid
+
+    def unsend(self, mid):
+        self._call()
+        self._messages.pop(mid, None)
+
+    def fetchUserInfo(self, *user_ids):
+        self._call()
+        return {uid: _User(uid) for uid in user_ids}
+
+    def fetchMessageInfo(self, mid, thread_id=None):
+        self._call()
+        message = self._messages.get(mid)
+        if message is None:
+            message = make_message(mid, 'fetched', '1')
+        return message
+
+    def fetchGroupInfo(self, *group_ids):
+        self._call()
+        return {
+            gid: _Group(str(1000 + i) for i in range(self.group_size))
+            for gid in group_ids
+        }
+
+
+def make_message(mid, text, author, timestamp=None):
+    """Create a fbchat.models.Message, like the ones received by the listener"""
+    message = models.Message(text=text)
+    message.uid = mid
+    message.author = author
+    message.timestamp = str(int((timestamp or time.time())*1000))
+    message.reactions = {}
+    message.replied_to = None
+    return message
+
+
+def message_kwargs(mid, text, author, thread_id, thread_type=models.ThreadType.GROUP):
+    """Returns kwargs like the ones passed to fbchat's onMessage"""
+    return {
+        'mid': mid,
+        'author_id': author,
+        'message_object': make_message(mid, text, author),
+        'thread_id': thread_id,
+        'thread_type': thread_type,
+        'ts': int(time.time()*1000),
+        'metadata': {},
+        'msg': {},
+    }
+
+
+def reaction_kwargs(mid, reaction, author, thread_id, thread_type=models.ThreadType.GROUP):
+    """Returns kwargs like the ones passed to fbchat's onReactionAdded"""
+    return {
+        'mid': mid,
+        'reaction': reaction,
+        'author_id': author,
+        'thread_id': thread_id,
+        'thread_type': thread_type,
+        'ts': int(time.time()*1000),
+        'msg': {},
+    }
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Import time benchmark
+
+Imports parts of Stibium in fresh interpreters, and prints
+the median import time of each, and the heavy modules
+they pulled in, as JSON. With --budget, exits with an error
+if any import takes longer than the budget.
+
+Example:
+    python benchmarks/startup.py --repeat 20
+    python benchmarks/startup.py --budget stibium.handlers=30
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+TARGETS = ('stibium', 'stibium.handlers', 'stibium.contrib', 'stibium.bot')
+
+# modules which should only be imported when they're needed
+HEAVY = ('fbchat', 'attr', 'asyncio', 'http.server', 'sqlite3', 'gettext')
+
+_SCRIPT = '''
+import sys, time, json
+start = time.perf_counter()
+import {target}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [m for m in {heavy!r} if m in sys.modules]]))
+'''
+
+
+def measure(target, repeat):
+    """Returns the import times of a module and the heavy modules it imported"""
+    times = []
+    loaded = []
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', _SCRIPT.format(target=target, heavy=HEAVY)],
+            env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True
+        ).stdout
+        elapsed, loaded = json.loads(output)
+        times.append(elapsed)
+    return {
+        'median_ms': statistics.median(times) * 1000,
+        'min_ms': min(times) * 1000,
+        'imports': loaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--target', action='append', help='module to import (repeatable), default: ' + ','.join(TARGETS))
+    parser.add_argument('--budget', action='append', default=[], metavar='MODULE=MS', help='fail if the median import time is longer')
+    parser.add_argument('--output', help='write the JSON result to a file instead of stdout')
+    args = parser.parse_args()
+
+    budgets = {}
+    for budget in args.budget:
+        module, _, ms = budget.partition('=')
+        budgets[module] = float(ms)
+    targets = args.target or list(TARGETS)
+    targets += [t for t in budgets if t not in targets]
+    result = {
+        'benchmark': 'startup',
+        'python': sys.version.split()[0],
+        'repeat': args.repeat,
+        'imports': {target: measure(target, args.repeat) for target in targets},
+    }
+    over = [
+        target for target, ms in budgets.items()
+        if result['imports'][target]['median_ms'] > ms
+    ]
+    result['over_budget'] = over
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(output + '\n')
+    else:
+        print(output)
+    if over:
+        sys.exit(f'Import time over budget: {", ".join(over)}')
+
+
+if __name__ == '__main__':
+    main()
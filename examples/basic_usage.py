@@ -9,6 +9,10 @@ import stibium
 with open('login.json') as fd:
     config = json.load(fd)
 
+# Logging is set up once for the whole process, optionally.
+# The format can be 'text', 'json', or None to use your own handlers.
+stibium.configure_logging(fmt='text')
+
 # Create the bot's object
 bot = stibium.Bot(
     name = 'Example bot',
@@ -38,6 +42,9 @@ def my_command(
     ):
     result = random.choice(['Heads!', 'Tails!'])
     message.reply(result)
+# `bot.register` returns the handler, so `my_command` is the CommandHandler.
+# It can be unregistered later with `my_command.registration.cancel()`
+# (or `bot.unregister(my_command)`).
 
 # Test out the exception handler
 @bot.register
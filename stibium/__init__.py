@@ -4,5 +4,36 @@
 __version__ = '0.3' # Semantic Versioning, see <semver.org>
 __author__ = 'szymonszl'
 
-from .bot import Bot
-from . import dataclasses, handlers, contrib
+# Submodules and classes are imported on first access, so that
+# importing a part of Stibium (like stibium.handlers) stays fast.
+import importlib
+
+_LAZY = {
+    'Bot': ('.bot', 'Bot'),
+    'AsyncBot': ('.asyncbot', 'AsyncBot'),
+    'BotGroup': ('.botgroup', 'BotGroup'),
+    'dataclasses': ('.dataclasses', None),
+    'handlers': ('.handlers', None),
+    'contrib': ('.contrib', None),
+    'eventlog': ('.eventlog', None),
+    'metrics': ('.metrics', None),
+    'configure_logging': ('._logs', 'configure'),
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    try:
+        module, attribute = _LAZY[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+    value = importlib.import_module(module, __name__)
+    if attribute is not None:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
@@ -0,0 +1,105 @@
+"""This module provides the circuit breaker for failing handlers"""
+import collections
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the error rate of a handler in a sliding window
+
+    When at least `error_rate` of the calls in the last `window` seconds
+    failed (and there were at least `min_calls`), the breaker opens
+    and calls aren't allowed. After `cooldown` seconds it's half-open,
+    and allows one trial call: if it succeeds the breaker closes again,
+    if it fails it opens for another cooldown.
+    """
+    buckets = 10 # the window is counted in this many parts
+    min_calls = 5
+
+    def __init__(self, window=60, error_rate=0.5, cooldown=30, timefunc=time.monotonic):
+        self.window = window
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.timefunc = timefunc
+        self.state = CLOSED
+        self.opened = None
+        self._trial = False
+        self._counts = collections.deque() # [bucket start, calls, errors]
+        self._calls = 0
+        self._errors = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns True if a call is allowed"""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            if self.state == OPEN and self.timefunc() - self.opened >= self.cooldown:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return self.state == CLOSED
+
+    def record(self, ok):
+        """
+        Record the result of a call, returns True if the state changed
+
+        `ok` is None for calls which didn't fail but didn't do anything
+        either (a check which didn't match), they're only counted
+        as successful trials.
+        """
+        if ok is None and self.state == CLOSED:
+            return False
+        now = self.timefunc()
+        with self._lock:
+            if self.state != CLOSED:
+                if not self._trial: # a call allowed before the breaker opened
+                    return False
+                self._trial = False
+                if ok is not False:
+                    self.state = CLOSED
+                    self._counts.clear()
+                    self._calls = self._errors = 0
+                    return True
+                self.state = OPEN # still open, not reported again
+                self.opened = now
+                return False
+            if ok is None:
+                return False
+            self._add(now, ok)
+            if (
+                    self._errors and self._calls >= self.min_calls
+                    and self._errors >= self.error_rate * self._calls
+                ):
+                self.state = OPEN
+                self.opened = now
+                return True
+            return False
+
+    def _add(self, now, ok):
+        step = self.window / self.buckets
+        while self._counts and self._counts[0][0] <= now - self.window:
+            _, calls, errors = self._counts.popleft()
+            self._calls -= calls
+            self._errors -= errors
+        if not self._counts or self._counts[-1][0] + step <= now:
+            self._counts.append([now, 0, 0])
+        bucket = self._counts[-1]
+        bucket[1] += 1
+        self._calls += 1
+        if not ok:
+            bucket[2] += 1
+            self._errors += 1
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'calls': self._calls,
+            'errors': self._errors,
+        }
@@ -0,0 +1,139 @@
+"""This module provides the caches used by the Bot class"""
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """
+    Thread-safe LRU cache with an optional TTL
+
+    At most `maxsize` entries are kept, the least recently used one
+    is evicted first. Entries older than `ttl` seconds are treated
+    as missing, so they are fetched again.
+    Hits and misses are counted for the bot's statistics.
+    """
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict() # key -> (time added, value)
+        self._inflight = {} # key -> Future, for keys being fetched
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not _MISSING
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        if self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def get(self, key, default=None):
+        """Get a value, counting a hit or a miss"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """Get a value without counting it or refreshing its position"""
+        with self._lock:
+            entry = self._data.get(key)
+            return default if entry is None else entry[1]
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used one if needed"""
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove a value"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_many(self, keys, fetch):
+        """
+        Get values for many keys, fetching all missing ones at once.
+
+        `fetch` is called with a list of missing keys, and should
+        return a dict of their values. Keys which are already being
+        fetched by another thread are not fetched again, their
+        result is waited for instead.
+        Keys not returned by `fetch` are left out of the result.
+        """
+        result = {}
+        waiting = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                if key in result or key in waiting or key in missing:
+                    continue
+                value = self._lookup(key)
+                if value is not _MISSING:
+                    self.hits += 1
+                    result[key] = value
+                    continue
+                self.misses += 1
+                if key in self._inflight:
+                    waiting[key] = self._inflight[key]
+                else:
+                    self._inflight[key] = concurrent.futures.Future()
+                    missing.append(key)
+        if missing:
+            try:
+                fetched = fetch(missing)
+            except BaseException as ex:
+                with self._lock:
+                    for key in missing:
+                        self._inflight.pop(key).set_exception(ex)
+                raise
+            with self._lock:
+                for key in missing:
+                    value = fetched.get(key, _MISSING)
+                    if value is not _MISSING:
+                        self.set(key, value)
+                        result[key] = value
+                    self._inflight.pop(key).set_result(value)
+        for key, future in waiting.items():
+            value = future.result()
+            if value is not _MISSING:
+                result[key] = value
+        return result
+
+    def stats(self):
+        """Returns a dict with the cache's size and hit counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,74 @@
+"""This module provides suppression of events delivered more than once"""
+import collections
+import threading
+import time
+
+from .dataclasses import MessageReaction
+
+
+class Deduplicator(object):
+    """
+    Remembers recently seen events, to drop ones delivered again
+
+    At most `maxsize` events from the last `ttl` seconds are kept,
+    oldest first, as hashes of their keys, so the memory used
+    doesn't depend on the number of events.
+    """
+    def __init__(self, maxsize=16384, ttl=600, timefunc=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timefunc = timefunc
+        self.hits = 0
+        self._seen = collections.OrderedDict() # key hash -> time seen
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(func, event):
+        """
+        Returns the key identifying an event, or None if it can't be identified.
+        Reactions are keyed by the message and their author, added
+        reactions also by the reaction (it's not passed when removed).
+        """
+        if func == 'onMessage':
+            return (func, event.mid)
+        if func == 'onReactionAdded':
+            return (func, event.mid, event.uid, event.reaction)
+        if func == 'onReactionRemoved':
+            return (func, event.mid, event.uid)
+        mid = event.get('mid') if isinstance(event, dict) else None
+        if mid is None:
+            return None
+        return (func, mid)
+
+    def seen(self, func, event):
+        """Returns True if the event was seen before, otherwise remembers it"""
+        key = self.key(func, event)
+        if key is None:
+            return False
+        key = hash(key)
+        now = self.timefunc()
+        with self._lock:
+            if key in self._seen:
+                self.hits += 1
+                return True
+            self._seen[key] = now
+            # removing or changing a reaction and adding it again isn't
+            # a duplicate, so other reactions of the author are forgotten
+            if func == 'onReactionAdded':
+                self._seen.pop(hash(('onReactionRemoved', event.mid, event.uid)), None)
+            if func in ('onReactionAdded', 'onReactionRemoved'):
+                for reaction in MessageReaction:
+                    if reaction != getattr(event, 'reaction', None):
+                        self._seen.pop(hash(('onReactionAdded', event.mid, event.uid, reaction)), None)
+            while self._seen:
+                oldest = next(iter(self._seen.values()))
+                if len(self._seen) <= self.maxsize and oldest > now - self.ttl:
+                    break
+                self._seen.popitem(last=False)
+        return False
+
+    def stats(self):
+        return {
+            'size': len(self._seen),
+            'hits': self.hits,
+        }
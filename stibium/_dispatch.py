@@ -0,0 +1,123 @@
+"""This module provides the handler index used for dispatching events"""
+
+import re
+import threading
+
+from .handlers import CommandHandler, ReactionHandler
+
+
+class Dispatcher(object):
+    """
+    Index of registered handlers
+
+    Command handlers with a plain command name are stored in a dict
+    keyed by their lowercased name. Incoming messages are parsed
+    only once, and only the handlers registered for the parsed
+    command are checked. All other handlers (including commands
+    defined with a regex) are kept in a per-event fallback list.
+    Reaction handlers are indexed by the id of the message they
+    are waiting for, so a reaction only reaches the handlers
+    which care about that message.
+
+    Buckets are dicts used as ordered sets, so handlers are still
+    checked in the order they were registered, but can be removed
+    in constant time.
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._commands = {}
+        self._reactions = {}
+        self._handlers = {}
+        self._lock = threading.Lock()
+        # regex for: (assuming prefix=%)
+        # %command [args] # or
+        # % command [args]
+        self._regex = re.compile(
+            r'^{prefix}\s?(?P<command>\S+)(\s(?P<args>.+))?$'.format(
+                prefix=re.escape(prefix)
+            ),
+            re.IGNORECASE
+        )
+
+    def _index(self, handler):
+        """Returns the index and the key a handler is stored under"""
+        if isinstance(handler, CommandHandler) and handler.key is not None:
+            return self._commands, handler.key
+        if isinstance(handler, ReactionHandler) and handler.mid is not None:
+            return self._reactions, handler.mid
+        return self._handlers, handler.event
+
+    def add(self, handler):
+        """Add a handler, which has already been set up, to the index"""
+        index, key = self._index(handler)
+        with self._lock:
+            index.setdefault(key, {})[handler] = None
+
+    def remove(self, handler):
+        """Remove a handler from the index, returns False if it was not present"""
+        index, key = self._index(handler)
+        with self._lock:
+            bucket = index.get(key)
+            if bucket is None or handler not in bucket:
+                return False
+            del bucket[handler]
+            if not bucket:
+                # there can be thousands of short-lived mids, don't keep them
+                del index[key]
+            return True
+
+    def __contains__(self, handler):
+        index, key = self._index(handler)
+        return handler in index.get(key, ())
+
+    def parse(self, text):
+        """Split a command message into (command, args), or return None"""
+        if text is None:
+            return None
+        match = self._regex.match(text)
+        if match is None:
+            return None
+        return match.group('command').lower(), match.group('args') or ''
+
+    def candidates(self, func, event):
+        """
+        Returns the handlers which may be interested in an event.
+
+        For onMessage events, the command and its arguments are
+        stored in the message, so handlers don't need to match it again.
+        """
+        candidates = []
+        parsed = None
+        if func == 'onMessage':
+            parsed = self.parse(event.text)
+            if parsed is not None:
+                event.command, event.args = parsed
+        with self._lock:
+            if parsed is not None:
+                candidates.extend(self._commands.get(event.command, ()))
+            elif func == 'onReactionAdded':
+                candidates.extend(self._reactions.get(event.mid, ()))
+            candidates.extend(self._handlers.get(func, ()))
+        return candidates
+
+
+class Registration(object):
+    """
+    Token returned by Bot.register for many handlers,
+    and set as the `registration` attribute of every handler
+
+    It can be used to unregister the handlers passed to Bot.register,
+    which also cancels timeout and recurrent handlers that did not run yet.
+    """
+    def __init__(self, bot, handlers):
+        self.handlers = handlers
+        self._bot = bot
+    def __repr__(self):
+        return f'<{type(self).__name__} for {self.handlers!r}>'
+    @property
+    def active(self):
+        """True if any of the handlers is still registered"""
+        return any(self._bot.is_registered(h) for h in self.handlers)
+    def cancel(self):
+        """Unregister the handlers"""
+        self._bot.unregister(*self.handlers)
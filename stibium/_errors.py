@@ -0,0 +1,111 @@
+"""This module provides error reports, grouped and rate-limited"""
+import os
+import threading
+import time
+import traceback
+
+from ._logs import log
+
+
+def fingerprint(label, exc_info):
+    """
+    Returns a fingerprint of an exception: the handler's label, the exception
+    type and the place it was raised in, so repeats of one error are grouped
+    even when their messages differ.
+    """
+    exc_type, _, tb = exc_info
+    frame = None
+    while tb is not None:
+        frame = tb
+        tb = tb.tb_next
+    if frame is None:
+        where = None
+    else:
+        code = frame.tb_frame.f_code
+        where = f'{os.path.basename(code.co_filename)}:{frame.tb_lineno} in {code.co_name}'
+    return (label, exc_type.__name__, where)
+
+
+class _Seen(object):
+    __slots__ = ('first', 'count', 'last_message', 'event')
+    def __init__(self, now, message):
+        self.first = now
+        self.count = 0 # repeats since the last report
+        self.last_message = message
+        self.event = None
+
+
+class ErrorReporter(object):
+    """
+    Reports errors to the owner, once per fingerprint in every `window`
+
+    The first occurrence of an error is reported right away. Repeats
+    during the next `window` seconds are only counted, and reported
+    together in one digest when the window ends. If there were none,
+    the error is forgotten, so the next occurrence is reported again.
+    `send` is called with the report's text, `schedule` like
+    Scheduler.enter. If `errors_log` (a logger) is set, the full
+    traceback of every occurrence is written to it.
+    """
+    def __init__(self, send, schedule, window=600, errors_log=None):
+        self.send = send
+        self.schedule = schedule
+        self.window = window
+        self.errors_log = errors_log
+        self.reported = 0
+        self.suppressed = 0
+        self._seen = {} # fingerprint -> _Seen
+        self._lock = threading.Lock()
+
+    def report(self, label, exc_info, thread=None):
+        """Report an exception, returns True if it was sent right away"""
+        key = fingerprint(label, exc_info)
+        message = traceback.format_exception_only(*exc_info[:2])[-1].strip()
+        if self.errors_log is not None:
+            self.errors_log.error('Error in %s, in thread %s', label, thread, exc_info=exc_info)
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is not None:
+                seen.count += 1
+                seen.last_message = message
+                self.suppressed += 1
+                return False
+            seen = self._seen[key] = _Seen(time.time(), message)
+            self.reported += 1
+        self._send(f'Error in {label}, at {key[2]}:\n{message}')
+        seen.event = self.schedule(self.window, self._digest, (key,))
+        return True
+
+    def _digest(self, key):
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is None:
+                return
+            if not seen.count:
+                del self._seen[key]
+                return
+            count, seen.count = seen.count, 0
+            self.reported += 1
+        if self.window >= 60:
+            window = f'{self.window / 60:g} minutes'
+        else:
+            window = f'{self.window:g} seconds'
+        self._send(
+            f'Error in {key[0]}, at {key[2]}, repeated {count} times '
+            f'in the last {window}, most recently:\n{seen.last_message}'
+        )
+        seen.event = self.schedule(self.window, self._digest, (key,))
+
+    def _send(self, text):
+        try:
+            self.send(text)
+        except Exception: # pylint: disable=broad-except
+            log.exception('Could not send an error report')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'fingerprints': len(self._seen),
+                'reported': self.reported,
+                'suppressed': self.suppressed,
+            }
@@ -0,0 +1,128 @@
+"""This module provides the worker pool running event handlers"""
+
+import collections
+import queue
+import threading
+
+from ._logs import log
+
+_STOP = object()
+
+
+class Executor(object):
+    """
+    Worker pool running event handlers
+
+    Tasks are submitted together with a key (the id of the thread
+    the event came from). Tasks with the same key are run in order,
+    one at a time, while tasks with different keys run in parallel.
+    A key of None means the task does not need to be ordered.
+
+    At most `max_pending` tasks can wait in the pool, submitting
+    more blocks until a worker finishes one. With `workers=0`
+    tasks are run immediately, in the submitting thread.
+    """
+    def __init__(self, workers=4, max_pending=1000):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.submitted = 0
+        self.completed = 0
+        self.max_depth = 0
+        self._pending = 0
+        self._queues = {} # key -> deque of tasks, present while the key is queued or running
+        self._ready = queue.SimpleQueue() # keys with tasks to run
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads, if they are not running yet"""
+        with self._cond:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f'WorkerThread-{len(self._threads)}',
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        """Stop the worker threads after they finish the queued tasks"""
+        with self._cond:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._ready.put(_STOP)
+        for thread in threads:
+            thread.join()
+
+    def submit(self, key, fn, *args):
+        """Queue fn(*args) to be run after the previous tasks with the same key"""
+        if self.workers == 0:
+            self._run(fn, args)
+            return
+        if not self._threads:
+            self.start()
+        self._slots.acquire()
+        with self._cond:
+            if key is None:
+                key = object() # not ordered with anything
+            self._pending += 1
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self._pending)
+            tasks = self._queues.get(key)
+            if tasks is None:
+                tasks = self._queues[key] = collections.deque()
+                self._ready.put(key)
+            tasks.append((fn, args))
+
+    def join(self, timeout=None):
+        """Wait until all submitted tasks are finished, returns False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+
+    @property
+    def depth(self):
+        """Number of tasks waiting or running"""
+        return self._pending
+
+    def stats(self):
+        """Returns a dict with the pool's queue metrics"""
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'depth': self._pending,
+                'max_depth': self.max_depth,
+                'max_pending': self.max_pending,
+                'active_keys': len(self._queues),
+                'submitted': self.submitted,
+                'completed': self.completed,
+            }
+
+    @staticmethod
+    def _run(fn, args):
+        try:
+            fn(*args)
+        except Exception: # pylint: disable=broad-except
+            # handlers are run through Bot._run_untrusted, this should not happen
+            log.exception('Uncaught exception in a worker task')
+
+    def _worker(self):
+        while True:
+            key = self._ready.get()
+            if key is _STOP:
+                return
+            with self._cond:
+                fn, args = self._queues[key].popleft()
+            self._run(fn, args)
+            self._slots.release()
+            with self._cond:
+                self._pending -= 1
+                self.completed += 1
+                if self._queues[key]:
+                    # requeue instead of draining, so one busy thread can't hog a worker
+                    self._ready.put(key)
+                else:
+                    del self._queues[key]
+                if self._pending == 0:
+                    self._cond.notify_all()
@@ -1,7 +1,66 @@
 """This class provides the hooks to the standard fbchat Client class"""
 import fbchat
+import requests
+
 from .dataclasses import Thread, Message, Reaction
 
 
+def _raw(kwargs, bot): # pylint: disable=unused-argument
+    return kwargs
+
+# Events passed to the bot, with functions creating the event objects.
+# Events without a Stibium data class are passed as the kwargs dict.
+EVENTS = {
+    'onMessage': Message.fromkwargs,
+    'onReactionAdded': Reaction.fromkwargs,
+    'onReactionRemoved': Reaction.fromkwargs,
+    'onPeopleAdded': _raw,
+    'onPersonRemoved': _raw,
+}
+
+
+def is_transient(ex):
+    """Returns True for errors of requests which surely weren't handled by Facebook"""
+    if isinstance(ex, requests.ConnectTimeout):
+        return True
+    # rate limited or unavailable
+    return getattr(ex, 'request_status_code', None) in (429, 503)
+
+
+def handle_event(bot, func, kwargs):
+    """Pass an event, as received by fbchat's callback, to the bot"""
+    event = EVENTS[func](kwargs, bot)
+    bot._fbchat_callback_handler(func, Thread.fromkwargs(kwargs), event) # pylint: disable=protected-access
+
+
 class Client(fbchat.Client):
-    pass # FIXME
\ No newline at end of file
+    """
+    fbchat Client passing events to a Stibium bot
+
+    If `recorder` (an EventRecorder) is set, every event's
+    kwargs are recorded before being handled.
+    """
+    def __init__(self, bot, *args, recorder=None, **kwargs):
+        self._bot = bot
+        self.recorder = recorder
+        super().__init__(*args, **kwargs)
+
+    def _event(self, func, kwargs):
+        if self.recorder is not None:
+            self.recorder.record(func, kwargs)
+        handle_event(self._bot, func, kwargs)
+
+    def onMessage(self, **kwargs): # pylint: disable=arguments-differ
+        self._event('onMessage', kwargs)
+
+    def onReactionAdded(self, **kwargs): # pylint: disable=arguments-differ
+        self._event('onReactionAdded', kwargs)
+
+    def onReactionRemoved(self, **kwargs): # pylint: disable=arguments-differ
+        self._event('onReactionRemoved', kwargs)
+
+    def onPeopleAdded(self, **kwargs): # pylint: disable=arguments-differ
+        self._event('onPeopleAdded', kwargs)
+
+    def onPersonRemoved(self, **kwargs): # pylint: disable=arguments-differ
+        self._event('onPersonRemoved', kwargs)
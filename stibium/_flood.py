@@ -0,0 +1,155 @@
+"""This module provides rate limiting, of commands and sent messages"""
+
+import collections
+import math
+import threading
+import time
+
+from ._i18n import _
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter
+
+    Allows `rate` actions per second on average,
+    with bursts of up to `burst` actions.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+
+    def _refill(self, now):
+        if now <= self._last: # `now` can be taken before the bucket was created
+            return
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def delay(self, now=None):
+        """Returns how many seconds have to pass before a token is available"""
+        self._refill(time.monotonic() if now is None else now)
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def take(self, now=None):
+        """Take a token, returns False if none is available"""
+        if self.delay(now) > 0:
+            return False
+        self._tokens -= 1
+        return True
+
+    @property
+    def full(self):
+        self._refill(time.monotonic())
+        return self._tokens >= self.burst
+
+
+class _Buckets(object):
+    """Token buckets by key, forgetting the ones which are full again"""
+    def __init__(self, limit, max_keys):
+        count, seconds = limit
+        self.rate = count / seconds
+        self.burst = count
+        self.max_keys = max_keys
+        self._buckets = collections.OrderedDict() # least recently used first
+
+    def get(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def evict(self):
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_keys and not bucket.full:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RateLimit(object):
+    """
+    Flood control for commands
+
+    Limits are (count, seconds) tuples, allowing `count` uses
+    in `seconds`, separately for every user (`per_user`), every
+    conversation (`per_thread`) and every command (`per_command`).
+    One RateLimit can be shared by many commands, then the per user
+    and per thread limits apply to all of them together.
+    If `notify` is True, a user going over the limit gets one reply
+    saying when they can use the command again, otherwise commands
+    over the limit are silently ignored.
+    At most `max_keys` buckets of each kind are kept, buckets which
+    are full again are forgotten.
+    """
+    def __init__(self, per_user=None, per_thread=None, per_command=None, notify=False, max_keys=10000):
+        self.notify = notify
+        self.max_keys = max_keys
+        self.dropped = 0
+        self._scopes = [
+            (scope, _Buckets(limit, max_keys))
+            for scope, limit in (('user', per_user), ('thread', per_thread), ('command', per_command))
+            if limit is not None
+        ]
+        self._notified = collections.OrderedDict() # uid -> time until the notice is valid
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_rate(cls, rate):
+        """Returns a RateLimit from a RateLimit, a per user (count, seconds) tuple or None"""
+        if rate is None or isinstance(rate, cls):
+            return rate
+        return cls(per_user=rate)
+
+    def _key(self, scope, command, event):
+        if scope == 'user':
+            return event.uid
+        if scope == 'thread':
+            return event.thread.id_ if event.thread is not None else None
+        return command
+
+    def allow(self, command, event):
+        """
+        Take a token for a use of `command`, returns True if it's allowed.
+        If `notify` is set, replies to the first use over the limit.
+        """
+        now = time.monotonic()
+        with self._lock:
+            taken = [
+                buckets.get(self._key(scope, command, event))
+                for scope, buckets in self._scopes
+            ]
+            delay = max((bucket.delay(now) for bucket in taken), default=0)
+            if not delay:
+                for bucket in taken:
+                    bucket.take(now)
+            for scope in self._scopes:
+                scope[1].evict()
+            if not delay:
+                return True
+            self.dropped += 1
+            if not self.notify or self._notified.get(event.uid, 0) > now:
+                return False
+            self._notified[event.uid] = now + delay
+            self._notified.move_to_end(event.uid)
+            while self._notified and (
+                    len(self._notified) > self.max_keys
+                    or next(iter(self._notified.values())) <= now
+                ):
+                self._notified.popitem(last=False)
+        event.reply(_('Slow down! You can use this command again in {} seconds.').format(math.ceil(delay)))
+        return False
+
+    def stats(self):
+        with self._lock:
+            stats = {f'{scope}_keys': len(buckets) for scope, buckets in self._scopes}
+        stats['dropped'] = self.dropped
+        return stats
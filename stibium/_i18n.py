@@ -1,8 +1,14 @@
 """This module provides internationalization"""
-import gettext
 import os
 
 localedir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'locales')
-tr = gettext.translation('stibium', localedir=localedir, fallback=True)
-tr.install()
-_ = tr.gettext
+_translation = None
+
+
+def _(message):
+    """Translate a message, the catalog is loaded on first use"""
+    global _translation # pylint: disable=global-statement
+    if _translation is None:
+        import gettext # pylint: disable=import-outside-toplevel
+        _translation = gettext.translation('stibium', localedir=localedir, fallback=True)
+    return _translation.gettext(message)
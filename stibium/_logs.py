@@ -1,8 +1,135 @@
 """This module configures logging for Stibium"""
+import atexit
+import json
 import logging
-logging.basicConfig(format='%(asctime)s-%(name)s-%(levelname)s-%(message)s')
+import logging.handlers
+import queue
+
 log = logging.getLogger('stibium')
-log.setLevel(logging.DEBUG) # FIXME, should be defined at bot instantiation
 
 _fblog = logging.getLogger('client')
-_fblog.setLevel(logging.WARNING) # don't ask
+
+TEXT_FORMAT = '%(asctime)s-%(name)s-%(levelname)s-%(message)s'
+
+# fields which can be passed in `extra`, included in JSON logs,
+# as JSON key -> LogRecord attribute (`thread` is taken by logging)
+FIELDS = {'event': 'event', 'mid': 'mid', 'handler': 'handler', 'thread': 'fb_thread'}
+
+_listeners = {} # logger name -> (QueueHandler, QueueListener)
+_configured = False
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as JSON objects, one per line"""
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field, attribute in FIELDS.items():
+            value = getattr(record, attribute, None)
+            if value is not None:
+                entry[field] = value if isinstance(value, (str, int, float)) else repr(value)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler which leaves formatting to the listener
+
+    The default one formats the message in the logging thread,
+    which is what it's supposed to avoid. Records are only passed
+    between threads of one process, so they don't need to be pickled.
+    """
+    def prepare(self, record):
+        return record
+
+
+def _detach(logger):
+    queue_handler, listener = _listeners.pop(logger.name, (None, None))
+    if listener is not None:
+        listener.stop()
+        logger.removeHandler(queue_handler)
+
+
+def _attach(logger, handler):
+    """Make `logger` write to `handler` in a background thread"""
+    _detach(logger)
+    records = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+    _listeners[logger.name] = (queue_handler, listener)
+
+
+def configure(level=logging.INFO, fmt='text', filename=None):
+    """
+    Configure Stibium's logger, for the whole process
+
+    Call it once, before creating the bots, as
+    `stibium.configure_logging`. If it wasn't called, the first bot
+    created uses the defaults, or if the root logger has handlers,
+    records are passed to them.
+    `fmt` is either 'text', 'json' or None. If it's None, only the level
+    is set, and records are passed to the handlers configured by the
+    application. Otherwise they are written to `filename` (or stderr)
+    in a background thread, so logging never blocks the bot.
+    """
+    global _configured # pylint: disable=global-statement
+    _configured = True
+    log.setLevel(level)
+    _fblog.setLevel(max(level, logging.WARNING)) # don't ask
+    if fmt is None:
+        _detach(log)
+        log.propagate = True
+        return
+    if filename is None:
+        handler = logging.StreamHandler()
+    else:
+        handler = logging.FileHandler(filename, encoding='utf-8')
+    if fmt == 'json':
+        handler.setFormatter(JSONFormatter())
+    elif fmt == 'text':
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        raise ValueError(f'Unknown log format {fmt!r}')
+    _attach(log, handler)
+
+
+def configure_default():
+    """
+    Configure logging with the defaults, if the application didn't
+    configure Stibium's logger or the root logger
+    """
+    if _configured:
+        return
+    if logging.getLogger().handlers:
+        # records propagate to the application's handlers
+        configure(fmt=None)
+    else:
+        configure()
+
+
+def rotating_logger(name, filename, max_bytes=1024*1024, backups=3):
+    """Returns a logger writing only to a rotating file, in a background thread"""
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    handler = logging.handlers.RotatingFileHandler(
+        filename, maxBytes=max_bytes, backupCount=backups, encoding='utf-8'
+    )
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    _attach(logger, handler)
+    return logger
+
+
+@atexit.register
+def _flush():
+    for _, listener in list(_listeners.values()):
+        listener.stop()
+    _listeners.clear()
@@ -0,0 +1,161 @@
+"""This module provides running handler functions in other processes"""
+import concurrent.futures
+import copy
+import importlib
+import multiprocessing
+import threading
+
+from ._logs import log
+from .handlers import process_functions
+
+
+class OutboundActions(object):
+    """
+    Stands in for the bot in handlers running in another process
+
+    Messages sent by the handler are recorded,
+    and sent by the bot when the handler returns.
+    """
+    def __init__(self):
+        self.actions = []
+
+    def send(self, text, thread, mentions=None, reply=None, **kwargs): # pylint: disable=unused-argument
+        self.actions.append(('send', text, thread, {'mentions': mentions, 'reply': reply}))
+
+
+def snapshot(event):
+    """Returns a copy of an event which can be sent to another process"""
+    if not hasattr(event, 'bot'):
+        return event
+    event = copy.copy(event)
+    event.bot = None
+    if hasattr(event, 'raw'):
+        event.raw = None
+    if getattr(event, 'replied_to', None) is not None:
+        event.replied_to = snapshot(event.replied_to)
+    vars(event).pop('_message', None) # Reaction's cached message
+    return event
+
+
+def _resolve(module, qualname):
+    obj = importlib.import_module(module)
+    # functions passed to a handler with process=True are registered when
+    # the module creates the handler, their name can refer to the handler
+    fn = process_functions.get((module, qualname))
+    if fn is not None:
+        return fn
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def check_function(fn):
+    """Raises ValueError if fn can't be looked up by name in another process"""
+    module = getattr(fn, '__module__', None)
+    qualname = getattr(fn, '__qualname__', None)
+    try:
+        # a bound method resolves to the plain function, which isn't `fn`
+        found = module != '__main__' and _resolve(module, qualname) is fn
+    except (ImportError, AttributeError, TypeError):
+        found = False
+    if not found:
+        raise ValueError(
+            f'{fn!r} can\'t be run in another process: with process=True, '
+            'the handler function has to be defined at the top level of an '
+            'importable module, and not be a method'
+        )
+
+
+def _context():
+    # the bot runs many threads, forking it could copy a held lock
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _run(module, qualname, event):
+    """Runs in the pool's process"""
+    fn = _resolve(module, qualname)
+    actions = OutboundActions()
+    if hasattr(event, 'bot'):
+        event.bot = actions
+        if getattr(event, 'replied_to', None) is not None:
+            event.replied_to.bot = actions
+    result = fn(event, actions)
+    return actions.actions, result
+
+
+class ProcessOffload(object):
+    """
+    Runs handler functions in a pool of `workers` processes
+
+    Processes are started with forkserver (or spawn), not by forking
+    the bot. Functions are sent by module and name, so they have
+    to be defined at the top level of an importable module (not
+    the script run as __main__), directly or decorated with a
+    handler's `create`.
+    Calls taking longer than `timeout` seconds raise TimeoutError,
+    and the pool is replaced. There's no way to stop a single call,
+    so all of the pool's processes are killed, and other calls
+    running in it at that time fail with BrokenProcessPool.
+    The pool is also replaced after `recycle_after` calls, to limit
+    the effects of leaks in handlers.
+    """
+    def __init__(self, workers=2, timeout=60, recycle_after=1000):
+        self.workers = workers
+        self.timeout = timeout
+        self.recycle_after = recycle_after
+        self.calls = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self._pool = None
+        self._pool_calls = 0
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is not None and self._pool_calls >= self.recycle_after:
+                self._pool.shutdown(wait=False) # running calls still finish
+                self._pool = None
+                self.recycled += 1
+            if self._pool is None:
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=_context()
+                )
+                self._pool_calls = 0
+            self._pool_calls += 1
+            self.calls += 1
+            return self._pool
+
+    def _kill(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        # there's no public way to stop a running call
+        for process in list(getattr(pool, '_processes', {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False)
+
+    def run(self, fn, event):
+        """Call fn(event, actions) in a process, returns (actions, result)"""
+        pool = self._get_pool()
+        future = pool.submit(_run, fn.__module__, fn.__qualname__, snapshot(event))
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            self.timeouts += 1
+            log.warning('%s timed out after %ss, restarting the process pool', fn.__qualname__, self.timeout)
+            self._kill(pool)
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'timeouts': self.timeouts,
+            'recycled': self.recycled,
+        }
@@ -0,0 +1,191 @@
+"""This module provides the rate-limited queue for outgoing messages"""
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+from ._flood import TokenBucket
+from ._logs import log
+
+
+class _Outgoing(object):
+    __slots__ = ('text', 'thread', 'mentions', 'reply', 'coalesce', 'future', 'attempts')
+    def __init__(self, text, thread, mentions, reply, coalesce):
+        self.text = text
+        self.thread = thread
+        self.mentions = mentions
+        self.reply = reply
+        self.coalesce = coalesce and not mentions and reply is None
+        self.future = concurrent.futures.Future()
+        self.attempts = 0
+
+
+class Outbox(object):
+    """
+    Queue of outgoing messages
+
+    Messages are sent by a background thread through `send_fn`,
+    limited by a global token bucket and a token bucket for every thread.
+    Threads with messages waiting take turns, so a throttled thread
+    does not hold up the others. Queued messages sent with
+    coalesce=True to the same thread are joined into one message,
+    up to `coalesce_limit` characters. Sends failing with an error
+    for which `transient` returns True are retried `retries` times:
+    the messages are queued again, and their thread waits `backoff`
+    seconds, doubled every time, while other threads keep sending.
+    Other errors aren't retried, as the message could have been sent.
+    """
+    def __init__(
+            self, send_fn,
+            rate=None, burst=None,
+            thread_rate=None, thread_burst=None,
+            retries=3, backoff=1.0, coalesce_limit=2000, transient=None
+        ):
+        self._send_fn = send_fn
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._thread_rate = thread_rate
+        self._thread_burst = thread_burst
+        self._thread_buckets = {}
+        self.retries = retries
+        self.backoff = backoff
+        self.coalesce_limit = coalesce_limit
+        self.transient = transient
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        self._queues = collections.OrderedDict() # thread id -> deque of _Outgoing
+        self._not_before = {} # thread id -> time it can send again after a failure
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def put(self, text, thread, mentions=None, reply=None, coalesce=False):
+        """Queue a message, returns a Future resolving to its message id"""
+        outgoing = _Outgoing(text, thread, mentions, reply, coalesce)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='SendThread', daemon=True
+                )
+                self._thread.start()
+            self._queues.setdefault(thread.id_, collections.deque()).append(outgoing)
+            self._pending += 1
+            self._cond.notify()
+        return outgoing.future
+
+    @property
+    def depth(self):
+        """Number of messages waiting to be sent"""
+        return self._pending
+
+    def stats(self):
+        """Returns a dict with the outbox's counters"""
+        with self._cond:
+            return {
+                'depth': self._pending,
+                'threads': len(self._queues),
+                'sent': self.sent,
+                'coalesced': self.coalesced,
+                'failed': self.failed,
+            }
+
+    def _thread_bucket(self, thread):
+        bucket = self._thread_buckets.get(thread)
+        if bucket is None:
+            bucket = self._thread_buckets[thread] = TokenBucket(
+                self._thread_rate, self._thread_burst
+            )
+        return bucket
+
+    def _next(self):
+        """Wait until a thread can send, and take its next batch of messages"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                delay = None # None means waiting for a message
+                chosen = None
+                if self._queues and self._bucket is not None:
+                    delay = self._bucket.delay(now) or None
+                if delay is None:
+                    for thread in self._queues:
+                        wait = self._not_before.get(thread, now) - now
+                        if wait > 0:
+                            delay = wait if delay is None else min(delay, wait)
+                            continue
+                        if self._thread_rate is None:
+                            chosen = thread
+                            break
+                        wait = self._thread_bucket(thread).delay(now)
+                        if wait == 0:
+                            chosen = thread
+                            break
+                        delay = wait if delay is None else min(delay, wait)
+                if chosen is not None:
+                    break
+                self._cond.wait(delay)
+            if self._bucket is not None:
+                self._bucket.take(now)
+            if self._thread_rate is not None:
+                self._thread_bucket(chosen).take(now)
+            self._not_before.pop(chosen, None)
+            queue = self._queues.pop(chosen) # popped, so other threads go first next time
+            batch = [queue.popleft()]
+            length = len(batch[0].text)
+            while batch[0].coalesce and queue and queue[0].coalesce \
+                    and length + len(queue[0].text) < self.coalesce_limit:
+                batch.append(queue.popleft())
+                length += len(batch[-1].text) + 1
+            if queue:
+                self._queues[chosen] = queue
+            self._pending -= len(batch)
+            self._forget_idle_buckets()
+            return batch
+
+    def _forget_idle_buckets(self):
+        if len(self._thread_buckets) > 2 * len(self._queues) + 64:
+            for thread, bucket in list(self._thread_buckets.items()):
+                if thread not in self._queues and bucket.full:
+                    del self._thread_buckets[thread]
+
+    def _send(self, batch):
+        first = batch[0]
+        text = '\n'.join(outgoing.text for outgoing in batch)
+        return self._send_fn(text, first.thread, mentions=first.mentions, reply=first.reply)
+
+    def _retry(self, batch, ex):
+        """Queue a failed batch again, returns False if it shouldn't be retried"""
+        attempt = max(outgoing.attempts for outgoing in batch)
+        if attempt >= self.retries or self.transient is None or not self.transient(ex):
+            return False
+        delay = self.backoff * 2 ** attempt
+        thread = batch[0].thread
+        log.warning('Sending to %s failed, retrying in %.1fs', thread, delay, exc_info=True)
+        with self._cond:
+            queue = self._queues.pop(thread.id_, collections.deque())
+            for outgoing in reversed(batch):
+                outgoing.attempts = attempt + 1
+                queue.appendleft(outgoing)
+            self._queues[thread.id_] = queue
+            self._not_before[thread.id_] = time.monotonic() + delay
+            self._pending += len(batch)
+            self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            batch = self._next()
+            try:
+                mid = self._send(batch)
+            except Exception as ex: # pylint: disable=broad-except
+                if self._retry(batch, ex):
+                    continue
+                log.error('Could not send a message to %s', batch[0].thread, exc_info=True)
+                self.failed += len(batch)
+                for outgoing in batch:
+                    outgoing.future.set_exception(ex)
+                continue
+            self.sent += 1
+            self.coalesced += len(batch) - 1
+            for outgoing in batch:
+                outgoing.future.set_result(mid)
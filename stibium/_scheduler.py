@@ -0,0 +1,126 @@
+"""This module provides the scheduler used for timed events"""
+
+import heapq
+import itertools
+import threading
+import time
+
+from ._logs import log
+
+
+class ScheduledEvent(object):
+    """
+    Handle for a scheduled call
+
+    It can be used to inspect when and what is going to be called,
+    and to cancel the call before it happens.
+    """
+    __slots__ = ('time', 'action', 'args', 'cancelled', 'done', '_seq', '_scheduler')
+    def __init__(self, scheduler, seq, time_, action, args):
+        self.time = time_
+        self.action = action
+        self.args = args
+        self.cancelled = False
+        self.done = False
+        self._seq = seq
+        self._scheduler = scheduler
+    def __lt__(self, other):
+        return (self.time, self._seq) < (other.time, other._seq)
+    def __repr__(self):
+        name = getattr(self.action, '__name__', repr(self.action))
+        return f'<{type(self).__name__} at {self.time:.3f} for {name}{self.args!r}>'
+    @property
+    def pending(self):
+        return not (self.cancelled or self.done)
+    def cancel(self):
+        """Cancel the call, returns False if it already happened"""
+        return self._scheduler.cancel(self)
+
+
+class Scheduler(object):
+    """
+    Event-driven scheduler for timed calls
+
+    Calls are kept in a heap ordered by their time. The thread running
+    the scheduler sleeps until the earliest call is due, and is woken up
+    early if an earlier call is added. Cancelled calls are only marked,
+    and are dropped from the heap when they reach its top, or when
+    they make up most of it.
+    """
+    def __init__(self, timefunc=time.time):
+        self._timefunc = timefunc
+        self._queue = []
+        self._cancelled = 0
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._queue) - self._cancelled
+
+    def enterabs(self, time_, action, args=()):
+        """Schedule action(*args) to be called at a unix timestamp"""
+        with self._cond:
+            event = ScheduledEvent(self, next(self._counter), time_, action, tuple(args))
+            heapq.heappush(self._queue, event)
+            if self._queue[0] is event: # wake up the thread, if it waits longer
+                self._cond.notify()
+        return event
+
+    def enter(self, delay, action, args=()):
+        """Schedule action(*args) to be called after `delay` seconds"""
+        return self.enterabs(self._timefunc() + delay, action, args)
+
+    def cancel(self, event):
+        """Cancel a scheduled call, returns False if it already happened"""
+        with self._cond:
+            if not event.pending:
+                return False
+            event.cancelled = True
+            self._cancelled += 1
+            if self._cancelled > 64 and self._cancelled > len(self._queue) // 2:
+                self._queue = [e for e in self._queue if not e.cancelled]
+                heapq.heapify(self._queue)
+                self._cancelled = 0
+            return True
+
+    def pending(self):
+        """Returns a list of the calls which are still scheduled, earliest first"""
+        with self._cond:
+            return sorted(e for e in self._queue if not e.cancelled)
+
+    def _next(self):
+        """Wait for the next due call and remove it from the queue"""
+        with self._cond:
+            while True:
+                while self._queue and self._queue[0].cancelled:
+                    heapq.heappop(self._queue)
+                    self._cancelled -= 1
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                delay = self._queue[0].time - self._timefunc()
+                if delay <= 0:
+                    event = heapq.heappop(self._queue)
+                    event.done = True
+                    return event
+                self._cond.wait(delay)
+
+    def start(self):
+        """Run the scheduler in a daemon thread, if it isn't running yet"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name='TimeoutThread', daemon=True)
+        self._thread.start()
+
+    def run(self):
+        """Run the scheduled calls, never returns"""
+        log.debug('Started the scheduler')
+        while True:
+            event = self._next()
+            try:
+                event.action(*event.args)
+            except Exception: # pylint: disable=broad-except
+                log.exception('Scheduled call %r failed', event)
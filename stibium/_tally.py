@@ -0,0 +1,72 @@
+"""This module provides reaction counting for watched messages"""
+
+import collections
+import threading
+
+
+class ReactionTally(object):
+    """
+    Per-message reaction counts
+
+    Only messages which are watched (for example by
+    a ReactionCountHandler) are counted. Counts are updated in place
+    from reaction events, so reading them does not need a network request.
+    """
+    def __init__(self):
+        self._watchers = {} # mid -> number of watchers
+        self._votes = {} # mid -> {uid: reaction}
+        self._counts = {} # mid -> Counter of reactions
+        self._lock = threading.Lock()
+
+    def __contains__(self, mid):
+        return mid in self._watchers
+
+    def watch(self, mid, reactions=None):
+        """
+        Start counting reactions to a message.
+        `reactions` ({uid: reaction}) are the reactions it already has.
+        """
+        with self._lock:
+            if mid in self._watchers:
+                self._watchers[mid] += 1
+                return
+            self._watchers[mid] = 1
+            self._votes[mid] = dict(reactions or {})
+            self._counts[mid] = collections.Counter(self._votes[mid].values())
+
+    def unwatch(self, mid):
+        """Stop counting reactions to a message, if nothing else watches it"""
+        with self._lock:
+            if mid not in self._watchers:
+                return
+            self._watchers[mid] -= 1
+            if self._watchers[mid] == 0:
+                del self._watchers[mid]
+                del self._votes[mid]
+                del self._counts[mid]
+
+    def update(self, func, event):
+        """Update the counts from an onReactionAdded or onReactionRemoved event"""
+        with self._lock:
+            votes = self._votes.get(event.mid)
+            if votes is None:
+                return
+            counts = self._counts[event.mid]
+            old = votes.pop(event.uid, None)
+            if old is not None:
+                counts[old] -= 1
+            if func == 'onReactionAdded':
+                votes[event.uid] = event.reaction
+                counts[event.reaction] += 1
+
+    def count(self, mid, reaction):
+        """Returns the number of `reaction` reactions to a watched message"""
+        counts = self._counts.get(mid)
+        if counts is None:
+            return 0
+        return counts[reaction]
+
+    def counts(self, mid):
+        """Returns a dict of reaction -> count for a watched message"""
+        with self._lock:
+            return {k: v for k, v in self._counts.get(mid, {}).items() if v > 0}
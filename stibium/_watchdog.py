@@ -0,0 +1,133 @@
+"""This module provides the watchdog reporting handlers which run for too long"""
+import collections
+import itertools
+import sys
+import threading
+import time
+import traceback
+
+from ._logs import log
+
+
+class _Running(object):
+    __slots__ = ('target', 'thread', 'ident', 'name', 'started', 'reported', 'next_sample', 'samples')
+    def __init__(self, target, thread, started):
+        current = threading.current_thread()
+        self.target = target
+        self.thread = thread
+        self.ident = current.ident
+        self.name = current.name
+        self.started = started
+        self.reported = False
+        self.next_sample = None
+        self.samples = collections.Counter() # formatted stack -> times seen
+
+
+def _format_stack(frame):
+    if frame is None:
+        return '(stack unavailable)'
+    return ''.join(traceback.format_stack(frame))
+
+
+class Watchdog(object):
+    """
+    Tracks running handlers and logs the stack of any running
+    for longer than `threshold` seconds.
+
+    If `sample_interval` is set, the stack of a slow handler is sampled
+    every `sample_interval` seconds until it finishes, and the most
+    common stacks are logged when it does.
+    """
+    def __init__(self, threshold, sample_interval=None, timefunc=time.monotonic):
+        self.threshold = threshold
+        self.sample_interval = sample_interval
+        self.timefunc = timefunc
+        self.reported = 0
+        self._running = {} # token -> _Running
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, target, thread=None):
+        """
+        Start tracking `target` (a handler, or the function if there's none)
+        running in the current thread, returns a token
+        """
+        token = next(self._tokens)
+        running = _Running(target, thread, self.timefunc())
+        with self._lock:
+            self._running[token] = running
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='WatchdogThread', daemon=True
+                )
+                self._thread.start()
+        return token
+
+    def finish(self, token):
+        """Stop tracking, logs a summary if the handler was reported as slow"""
+        with self._lock:
+            running = self._running.pop(token, None)
+        if running is not None and running.reported:
+            self._finished(running, self.timefunc() - running.started)
+
+    def call(self, target, thread, fun, *args):
+        """Call fun(*args), tracking `target` for the duration"""
+        token = self.start(target, thread)
+        try:
+            return fun(*args)
+        finally:
+            self.finish(token)
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            self._thread = None
+
+    def check(self):
+        """Report and sample slow handlers, called periodically by the watchdog thread"""
+        now = self.timefunc()
+        with self._lock:
+            slow = [r for r in self._running.values() if now - r.started >= self.threshold]
+        frames = None
+        for running in slow:
+            if running.reported and (running.next_sample is None or now < running.next_sample):
+                continue
+            if frames is None:
+                frames = sys._current_frames() # pylint: disable=protected-access
+            stack = _format_stack(frames.get(running.ident))
+            if not running.reported:
+                running.reported = True
+                self.reported += 1
+                log.warning(
+                    'Handler %r has been running for %.1fs for thread %s, in %s:\n%s',
+                    running.target, now - running.started,
+                    running.thread, running.name, stack
+                )
+            if self.sample_interval:
+                running.samples[stack] += 1
+                running.next_sample = now + self.sample_interval
+
+    def _finished(self, running, elapsed):
+        if not running.samples:
+            log.warning('Slow handler %r finished after %.1fs', running.target, elapsed)
+            return
+        total = sum(running.samples.values())
+        profile = '\n'.join(
+            f'{count}/{total} samples:\n{stack}'
+            for stack, count in running.samples.most_common(5)
+        )
+        log.warning(
+            'Slow handler %r finished after %.1fs, most common stacks:\n%s',
+            running.target, elapsed, profile
+        )
+
+    def _run(self):
+        tick = min(self.threshold, self.sample_interval or self.threshold) / 4
+        while not self._stop.wait(max(tick, 0.01)):
+            try:
+                self.check()
+            except Exception: # pylint: disable=broad-except
+                log.exception('Watchdog check failed')
@@ -0,0 +1,318 @@
+"""This module provides the asyncio-based AsyncBot class"""
+
+import asyncio
+import functools
+import inspect
+import logging
+import itertools
+import sys
+import threading
+import time
+
+from ._logs import log
+from ._scheduler import ScheduledEvent
+from .bot import Bot
+from .handlers import BaseHandler
+from .metrics import handler_label
+
+
+def _on_loop(loop):
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError: # no loop running in this thread
+        return False
+
+
+class LoopScheduler(object):
+    """Scheduler running timed calls on an asyncio event loop"""
+    def __init__(self, loop):
+        self._loop = loop
+        self._handles = {} # ScheduledEvent -> asyncio.TimerHandle, only used on the loop
+        self._pending = set() # scheduled events, read from any thread
+        self._lock = threading.Lock() # guards _pending
+        self._counter = itertools.count()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def enterabs(self, time_, action, args=()):
+        """Schedule action(*args) to be called at a unix timestamp"""
+        event = ScheduledEvent(self, next(self._counter), time_, action, tuple(args))
+        with self._lock:
+            self._pending.add(event)
+        if _on_loop(self._loop):
+            self._call_at(event)
+        else:
+            self._loop.call_soon_threadsafe(self._call_at, event)
+        return event
+
+    def enter(self, delay, action, args=()):
+        """Schedule action(*args) to be called after `delay` seconds"""
+        return self.enterabs(time.time() + delay, action, args)
+
+    def _call_at(self, event):
+        if event.cancelled:
+            return
+        when = self._loop.time() + (event.time - time.time())
+        self._handles[event] = self._loop.call_at(when, self._fire, event)
+
+    def _fire(self, event):
+        self._handles.pop(event, None)
+        with self._lock:
+            self._pending.discard(event)
+        if event.cancelled: # cancelled from another thread, before _cancel ran
+            return
+        event.done = True
+        event.action(*event.args)
+
+    def cancel(self, event):
+        """Cancel a scheduled call, returns False if it already happened"""
+        if not event.pending:
+            return False
+        event.cancelled = True
+        # the handles are only touched on the loop
+        if _on_loop(self._loop):
+            self._cancel(event)
+        else:
+            self._loop.call_soon_threadsafe(self._cancel, event)
+        return True
+
+    def _cancel(self, event):
+        with self._lock:
+            self._pending.discard(event)
+        handle = self._handles.pop(event, None)
+        if handle is not None:
+            handle.cancel()
+
+    def pending(self):
+        """Returns a list of the calls which are still scheduled, earliest first"""
+        with self._lock:
+            return sorted(e for e in self._pending if not e.cancelled)
+
+    def run(self):
+        """Timed calls are run by the event loop, nothing to do here"""
+
+
+class LoopExecutor(object):
+    """
+    Runs coroutines on an asyncio event loop
+
+    Like the threaded Executor, tasks submitted with the same key
+    are run in order, and tasks with different keys concurrently.
+    """
+    def __init__(self, loop):
+        self.submitted = 0
+        self.completed = 0
+        self._loop = loop
+        self._tasks = set() # the loop only keeps weak references to tasks
+        self._tails = {} # key -> last task submitted with that key
+
+    def submit(self, key, fn, *args):
+        """Run the coroutine fn(*args) after the previous tasks with the same key"""
+        if _on_loop(self._loop):
+            self._submit(key, fn, args)
+        else:
+            self._loop.call_soon_threadsafe(self._submit, key, fn, args)
+
+    def _submit(self, key, fn, args):
+        previous = self._tails.get(key) if key is not None else None
+        task = self._loop.create_task(self._run(previous, fn, args))
+        self.submitted += 1
+        self._tasks.add(task)
+        task.add_done_callback(functools.partial(self._done, key))
+        if key is not None:
+            self._tails[key] = task
+
+    async def _run(self, previous, fn, args):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await fn(*args)
+        except Exception: # pylint: disable=broad-except
+            log.exception('Uncaught exception in a task')
+
+    def _done(self, key, task):
+        self.completed += 1
+        self._tasks.discard(task)
+        if key is not None and self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def join(self):
+        """Wait until all submitted tasks are finished"""
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    @property
+    def depth(self):
+        """Number of tasks waiting or running"""
+        return len(self._tasks)
+
+    def stats(self):
+        """Returns a dict with the task metrics"""
+        return {
+            'depth': len(self._tasks),
+            'active_keys': len(self._tails),
+            'submitted': self.submitted,
+            'completed': self.completed,
+        }
+
+
+class AsyncBot(Bot):
+    """
+    Stibium Bot running on an asyncio event loop
+
+    Handler functions can be defined with `async def`, they are run
+    as coroutines on the loop. Regular handler functions are run in
+    the loop's default executor, so they can't block it.
+    Timeouts and recurrent handlers are scheduled on the loop too.
+    `send` called on the loop returns an awaitable resolving
+    to the sent message's id, instead of blocking.
+    """
+    loop = None
+
+    def __init__(self, name, prefix, fb_login, owner, loop=None, **kwargs):
+        # other keyword arguments are passed to Bot, except for workers
+        super().__init__(name, prefix, fb_login, owner, workers=0, **kwargs)
+        self.loop = loop or asyncio.new_event_loop()
+        self._scheduler = LoopScheduler(self.loop)
+        self._executor = LoopExecutor(self.loop)
+
+    def listen(self):
+        """Start listening for events, runs the event loop until stopped"""
+        self.loop.run_until_complete(self.listen_async())
+
+    async def listen_async(self):
+        """Listen for events, has to be awaited on the bot's loop"""
+        if not self._logged_in:
+            raise Exception('The bot is not logged in yet')
+        log.info('Starting listening...')
+        # fbchat's listener is blocking, its callbacks are passed to the loop
+        await self.loop.run_in_executor(None, self.fbchat_client.listen)
+
+    def send(self, text, thread, mentions=None, reply=None, coalesce=False, wait=True):
+        """
+        Send a message to a specified thread
+
+        When called on the loop, the message is sent in the background
+        and an awaitable resolving to its message id is returned.
+        """
+        if not _on_loop(self.loop):
+            return super().send(
+                text, thread, mentions=mentions, reply=reply, coalesce=coalesce, wait=wait
+            )
+        return asyncio.wrap_future(super().send(
+            text, thread, mentions=mentions, reply=reply, coalesce=coalesce, wait=False
+        ))
+
+    @staticmethod
+    def _blocking(handler: BaseHandler):
+        """Check if the handler's function has to be run outside of the loop"""
+        return not inspect.iscoroutinefunction(handler.handlerfn)
+
+    async def _handle_timeout(self, handler: BaseHandler):
+        self._timers.pop(handler, None)
+        await self._run_untrusted_async(
+            handler.execute,
+            args=(time.time(), self),
+            handler=handler,
+            thread=None,
+            notify=False,
+            blocking=self._blocking(handler),
+            metric=('timeout', handler_label(handler))
+        )
+
+    async def _handle_recurrent(self, handler: BaseHandler):
+        log.debug('Executing recurring handler %s', handler)
+        await self._run_untrusted_async(
+            handler.execute,
+            args=(time.time(), self),
+            handler=handler,
+            thread=None,
+            notify=False,
+            blocking=self._blocking(handler),
+            metric=('recurrent', handler_label(handler))
+        )
+        if handler in self._timers: # not unregistered while running
+            self._schedule_recurrent(handler)
+
+    async def _dispatch(self, func, thread, event):
+        for handler in self._dispatcher.candidates(func, event):
+            breaker = self._breakers.get(handler)
+            if breaker is not None and not breaker.allow():
+                continue
+            label = handler_label(handler)
+            valid = await self._run_untrusted_async(
+                handler.check,
+                args=[event, self],
+                handler=handler,
+                default=self._FAILED,
+                thread=thread,
+                notify=False,
+                metric=('check', label)
+            )
+            if valid is self._FAILED:
+                ok = False
+            elif not valid:
+                ok = None
+            else:
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(
+                        'Executing %s, reacting to %s', handler, event,
+                        extra={
+                            'event': func, 'mid': getattr(event, 'mid', None),
+                            'handler': handler, 'fb_thread': thread,
+                        }
+                    )
+                result = await self._run_untrusted_async(
+                    handler.execute,
+                    args=[event, self],
+                handler=handler,
+                    default=self._FAILED,
+                    thread=thread,
+                    blocking=self._blocking(handler),
+                    metric=('execute', label)
+                )
+                ok = result is not self._FAILED
+            if breaker is not None and breaker.record(ok):
+                self._breaker_changed(handler, breaker)
+
+    async def _run_untrusted_async( # pylint: disable=dangerous-default-value
+            self,
+            fun,
+            args=[],
+            handler=None,
+            thread=None,
+            notify=True,
+            default=None,
+            blocking=False,
+            metric=None
+        ):
+        start = time.perf_counter()
+        error = False
+        token = None
+        target = fun if handler is None else handler # tracked by the watchdog
+        try:
+            if blocking:
+                call = functools.partial(fun, *args)
+                if self.watchdog is not None:
+                    call = functools.partial(self.watchdog.call, target, thread, fun, *args)
+                result = await self.loop.run_in_executor(None, call)
+            else:
+                # coroutines are tracked on the loop's thread, so the stack
+                # is only useful when they block the loop
+                if self.watchdog is not None:
+                    token = self.watchdog.start(target, thread)
+                result = fun(*args)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        except Exception:
+            error = True
+            self._report_error(fun, handler, args, {}, thread, notify, sys.exc_info())
+            return default
+        finally:
+            if token is not None:
+                self.watchdog.finish(token)
+            if metric is not None:
+                self.metrics.observe(*metric, time.perf_counter() - start, error)
@@ -3,14 +3,27 @@
 import time
 import traceback
 import json
-import threading
-import sched
+import logging
+import sys
 
 from fbchat import models
 
-from ._fbclient import Client
-from ._logs import log
-from .dataclasses import Thread
+from ._fbclient import Client, is_transient
+from ._cache import LRUCache
+from ._dispatch import Dispatcher, Registration
+from ._executor import Executor
+from ._outbox import Outbox
+from ._tally import ReactionTally
+from .metrics import Metrics, handler_label
+from ._watchdog import Watchdog
+from ._scheduler import Scheduler
+from ._logs import log, configure_default as configure_default_logging, rotating_logger
+from ._errors import ErrorReporter
+from ._breaker import CircuitBreaker, OPEN, CLOSED
+from ._flood import RateLimit
+from ._offload import ProcessOffload, check_function
+from ._dedup import Deduplicator
+from .dataclasses import Thread, Message
 from .handlers import BaseHandler
 from ._i18n import _
 
@@ -23,97 +36,191 @@ class Bot(object):
     fbchat_client = None
     command_prefix = None
     _logged_in = False
-    _handlers = {}
-    _hooked_functions = []
-    _username_cache = {}
-    _scheduler = sched.scheduler(time.time, time.sleep)
+    _dispatcher = None
+    _timers = None
+    _username_cache = None
+    _message_cache = None
+    _scheduler = None
+    _executor = None
+    _outbox = None
+    reaction_tally = None
+    metrics = None
+    watchdog = None
+    _errors = None
+    _breakers = None
+    command_rate = None
+    _offload = None
+    _dedup = None
 
-    def __init__(self, name, prefix, fb_login, owner):
+    # returned by _run_untrusted when the function raised an exception
+    _FAILED = object()
+
+    def __init__(
+            self, name, prefix, fb_login, owner,
+            workers=4, queue_size=1000,
+            user_cache_size=1024, user_cache_ttl=24*60*60, message_cache_size=4096,
+            send_rate=None, thread_send_rate=None,
+            slow_handler_threshold=None, slow_handler_sample_interval=None,
+            error_window=600, error_log=None,
+            breaker_window=60, breaker_error_rate=0.5, breaker_cooldown=30,
+            command_rate=None,
+            process_workers=2, process_timeout=60, process_recycle=1000,
+            executor=None, scheduler=None, user_cache=None,
+            dedup_size=16384, dedup_ttl=600
+        ):
+        # logging is set up for the process by stibium.configure_logging
+        configure_default_logging()
         log.debug('__init__ called')
         self.name = name
         self.prefix = prefix
         self.fb_login = fb_login
-        if owner and False:
-            self.owner = None # FIXME
+        self._dispatcher = Dispatcher(prefix)
+        # the executor, scheduler and user name cache can be shared
+        # by bots running in one process, see BotGroup
+        self._scheduler = scheduler if scheduler is not None else Scheduler()
+        self._timers = {} # handler -> ScheduledEvent
+        self._executor = executor if executor is not None else Executor(workers, queue_size)
+        if user_cache is None:
+            user_cache = LRUCache(user_cache_size, user_cache_ttl)
+        self._username_cache = user_cache
+        self._message_cache = LRUCache(message_cache_size)
+        self.reaction_tally = ReactionTally()
+        self.metrics = Metrics()
+        self.metrics.add_gauges('queue', self.queue_stats)
+        self.metrics.add_gauges('cache', self.cache_stats)
+        # send rates are in messages per second, None means unlimited
+        self._outbox = Outbox(
+            self._send_now, rate=send_rate, thread_rate=thread_send_rate, transient=is_transient
+        )
+        # thresholds are in seconds, None disables the watchdog
+        if slow_handler_threshold is not None:
+            self.watchdog = Watchdog(slow_handler_threshold, slow_handler_sample_interval)
+        if owner:
+            self.owner = Thread.from_user_uid(owner)
         else:
             log.warning('Owner not set, DM error reporting disabled!')
+        # errors are reported to the owner once per error_window seconds,
+        # full tracebacks are written to the rotating error_log file if set
+        self._errors = ErrorReporter(
+            self._send_to_owner,
+            lambda delay, action, args: self._scheduler.enter(delay, action, args),
+            window=error_window,
+            errors_log=rotating_logger(f'stibium.errors.{name}', error_log) if error_log else None
+        )
+        self.metrics.add_gauges('errors', self._errors.stats)
+        # handlers failing in breaker_error_rate of calls in the last
+        # breaker_window seconds are disabled for breaker_cooldown seconds
+        self._breakers = {} # handler -> CircuitBreaker
+        self._breaker_config = (breaker_window, breaker_error_rate, breaker_cooldown)
+        # default flood control for commands without their own rate
+        self.command_rate = RateLimit.from_rate(command_rate)
+        if self.command_rate is not None:
+            self.metrics.add_gauges('flood', self.command_rate.stats)
+        # pool for handlers with process=True, started when first used
+        self._offload = ProcessOffload(process_workers, process_timeout, process_recycle)
+        self.metrics.add_gauges('processes', self._offload.stats)
+        # events delivered again (after reconnecting) are dropped,
+        # up to dedup_size events from the last dedup_ttl seconds are remembered
+        if dedup_size:
+            self._dedup = Deduplicator(dedup_size, dedup_ttl)
+            self.metrics.add_gauges('dedup', self._dedup.stats)
         log.debug('Object created')
 
-    def login(self):
-        """Log in to the bot account"""
+    def login(self, recorder=None):
+        """
+        Log in to the bot account
+
+        If `recorder` (a stibium.eventlog.EventRecorder) is passed,
+        all received events will be recorded, so they can be replayed later.
+        """
         log.debug('login called')
-        raise NotImplementedError # FIXME
+        email, password, cookie_file = self.fb_login
+        try:
+            with open(cookie_file) as fd:
+                cookies = json.load(fd)
+        except (OSError, ValueError):
+            cookies = None
+        self.fbchat_client = Client(
+            self, email, password, session_cookies=cookies, recorder=recorder
+        )
+        with open(cookie_file, 'w') as fd:
+            json.dump(self.fbchat_client.getSession(), fd)
         log.debug('Created and logged in the fbchat client...')
         self._logged_in = True
         log.info('Logged in!')
 
-    def _timeout_daemon(self):
-        log.debug('Started timeout daemon')
-        while True:
-            # the thread is a daemon, so this while does not need to be exited
-            self._scheduler.run(blocking=False)
-            time.sleep(1) # wait for more events
-
     def listen(self):
         """Start listening for events"""
         if not self._logged_in:
             raise Exception('The bot is not logged in yet')
         log.debug('Starting the timeout daemon...')
-        timeout_daemon = threading.Thread(
-            target=self._timeout_daemon,
-            name='TimeoutThread',
-            daemon=True
-        )
-        timeout_daemon.start()
+        self._scheduler.start()
         log.info('Starting listening...')
-        raise NotImplementedError # FIXME
+        self.fbchat_client.listen()
 
     def register(self, *handlers: BaseHandler):
-        """Register handlers"""
+        """
+        Register handlers
+
+        With one handler, returns the handler, so this can be used
+        as a decorator. With more, returns a Registration, which can be
+        used to unregister all of them. Every handler's `registration`
+        attribute is also set to the Registration.
+        """
+        registration = Registration(self, handlers)
         for handler in handlers:
-            log.debug('Registering a handler for function %s', repr(handler))
+            handler.registration = registration
+            log.debug('Registering a handler for function %r', handler)
             if handler.event is None:
                 raise Exception('Handler did not define event type')
+            if handler.process and callable(handler.handlerfn):
+                check_function(handler.handlerfn)
+            handler.setup(self)
             if handler.event == '_recurrent':
-                self._scheduler.enterabs(
-                    self._run_untrusted(
-                        handler.next_time,
-                        args=(time.time(),),
-                        notify=False
-                    ),
-                    0,
-                    self._handle_recurrent,
-                    argument=(handler,)
-                )
-                return
+                self._schedule_recurrent(handler)
+                continue
             if handler.event == '_timeout':
-                self._scheduler.enter(
+                self._timers[handler] = self._scheduler.enter(
                     handler.timeout,
-                    0,
-                    self._handle_timeout,
-                    argument=(handler,)
+                    self._executor.submit,
+                    args=(None, self._handle_timeout, handler)
                 )
-                return
-            if handler.event not in self._handlers.keys():
-                self._handlers[handler.event] = []
-            handler.setup(self)
-            self._handlers[handler.event].append(handler)
+                continue
+            self._dispatcher.add(handler)
+            self._breakers[handler] = CircuitBreaker(*self._breaker_config)
             if handler.timeout is not None:
-                self._scheduler.enter(
+                self._timers[handler] = self._scheduler.enter(
                     handler.timeout,
-                    0,
-                    self._handlers[handler.event].remove,
-                    argument=(handler,)
+                    self.unregister,
+                    args=(handler,)
                 )
-        if handlers:
-            return handlers[0] # for use as a decorator
+        if len(handlers) == 1:
+            return handlers[0] # used as a decorator
+        return registration
+
+    def unregister(self, *handlers: BaseHandler):
+        """Unregister handlers, cancelling their timeouts"""
+        for handler in handlers:
+            timer = self._timers.pop(handler, None)
+            if timer is not None:
+                timer.cancel()
+            self._breakers.pop(handler, None)
+            if self._dispatcher.remove(handler):
+                handler.teardown(self)
+
+    def is_registered(self, handler: BaseHandler):
+        """Check if a handler is registered, or still waiting to be run"""
+        return handler in self._timers or handler in self._dispatcher
 
     def _handle_timeout(self, handler: BaseHandler):
+        self._timers.pop(handler, None)
         self._run_untrusted(
             handler.execute,
             args=(time.time(), self),
+            handler=handler,
             thread=None,
-            notify=False
+            notify=False,
+            metric=('timeout', handler_label(handler))
         )
 
     def _handle_recurrent(self, handler: BaseHandler):
@@ -121,87 +228,247 @@ class Bot(object):
         self._run_untrusted(
             handler.execute,
             args=(time.time(), self),
+            handler=handler,
             thread=None,
+            notify=False,
+            metric=('recurrent', handler_label(handler))
+        )
+        if handler in self._timers: # not unregistered while running
+            self._schedule_recurrent(handler)
+
+    def _schedule_recurrent(self, handler: BaseHandler):
+        next_time = self._run_untrusted(
+            handler.next_time,
+            args=(time.time(),),
+            handler=handler,
             notify=False
         )
-        self._scheduler.enterabs(
-            self._run_untrusted(
-                handler.next_time,
-                args=(time.time(),),
-                notify=False
-            ),
-            0,
-            self._handle_recurrent,
-            argument=(handler,)
+        if next_time is None:
+            log.warning('Recurring handler %s has no next time, stopping it', handler)
+            self._timers.pop(handler, None)
+            return
+        self._timers[handler] = self._scheduler.enterabs(
+            next_time,
+            self._executor.submit,
+            args=(None, self._handle_recurrent, handler)
         )
 
-    def send(self, text, thread, mentions=None, reply=None):
-        """Send a message to a specified thread"""
+    def scheduled(self):
+        """Returns a list of pending timed events, earliest first"""
+        return self._scheduler.pending()
+
+    def queue_stats(self):
+        """Returns a dict with the metrics of the handler worker pool and the outbox"""
+        return {
+            'handlers': self._executor.stats(),
+            'outbox': self._outbox.stats(),
+            'scheduled': len(self._scheduler),
+            'open_breakers': sum(b.state != CLOSED for b in list(self._breakers.values())),
+        }
+
+    def send(self, text, thread, mentions=None, reply=None, coalesce=False, wait=True):
+        """
+        Send a message to a specified thread
+
+        Messages are queued and sent in the background, respecting
+        the bot's send rate limits. If `wait` is True, this waits until
+        the message is sent and returns its message id, otherwise
+        a Future resolving to the message id is returned.
+        If `coalesce` is True, the message can be joined with other
+        queued messages to the same thread (also sent with coalesce=True).
+        """
+        future = self._outbox.put(text, thread, mentions=mentions, reply=reply, coalesce=coalesce)
+        if wait:
+            return future.result()
+        return future
+
+    def _send_now(self, text, thread, mentions=None, reply=None):
         # TODO: add attachments, both here and in onMessage
-        raise NotImplementedError # FIXME
+        start = time.perf_counter()
+        try:
+            mid = self.fbchat_client.send(
+                models.Message(text=text, mentions=mentions, reply_to_id=reply),
+                thread_id=thread.id_,
+                thread_type=thread.type_
+            )
+        except Exception:
+            self.metrics.observe('send', 'Bot.send', time.perf_counter() - start, error=True)
+            raise
+        self.metrics.observe('send', 'Bot.send', time.perf_counter() - start)
+        # reactions to the bot's messages (like confirmations) are common,
+        # so the sent message is cached, to not have to fetch it later
+        self._message_cache.set(mid, Message(
+            mid=mid,
+            text=text,
+            uid=self.fbchat_client.uid,
+            thread=thread,
+            replied_to=self.cached_message(reply) if reply else None,
+            timestamp=time.time(),
+            reactions={},
+            raw=None,
+            bot=self,
+        ))
+        return mid
+
+    def run_in_process(self, fn, event):
+        """
+        Run a handler function in the process pool
+
+        The function gets a copy of the event without the bot and the raw
+        data, and an object standing in for the bot, which only has `send`.
+        Messages it sends (also with Message.reply) are sent when it returns.
+        The function has to be defined at the top level of a module.
+        Returns the function's result.
+        """
+        actions, result = self._offload.run(fn, event)
+        for action, text, thread, kwargs in actions:
+            if action == 'send':
+                self.send(text, thread, wait=False, **kwargs)
+        return result
 
     def get_user_name(self, uid):
         """Get the name of the user specified by uid"""
         uid = str(uid)
-        name = self._username_cache.get(uid)
-        if name is None:
-            raise NotImplementedError # FIXME
-            self._username_cache[uid] = name
-        return name
+        return self.get_user_names([uid]).get(uid)
+
+    def get_user_names(self, uids):
+        """
+        Get the names of many users, returns a dict of uid -> name.
+        Names which are not cached are fetched in a single request.
+        """
+        return self._username_cache.get_many(
+            [str(uid) for uid in uids],
+            self._fetch_user_names
+        )
+
+    def _fetch_user_names(self, uids):
+        log.debug('Fetching names of %d users', len(uids))
+        users = self.fbchat_client.fetchUserInfo(*uids)
+        return {uid: user.name for uid, user in users.items()}
+
+    def get_message(self, mid, thread):
+        """Get a message by its id, fetching it if it is not cached"""
+        mid = str(mid)
+        return self._message_cache.get_many(
+            [mid],
+            lambda mids: {mid: Message.from_mid(mid, thread, self)}
+        ).get(mid)
+
+    def cached_message(self, mid):
+        """Get a message by its id if it is cached, otherwise return None"""
+        return self._message_cache.get(str(mid))
+
+    def _update_message_cache(self, func, event):
+        if func == 'onMessage':
+            self._message_cache.set(event.mid, event)
+            return
+        message = self._message_cache.peek(event.mid)
+        if message is None:
+            return
+        # handlers may be iterating over the dict, so it's replaced with a changed copy
+        reactions = dict(message.reactions)
+        if func == 'onReactionAdded':
+            reactions[event.uid] = event.reaction
+        elif func == 'onReactionRemoved':
+            reactions.pop(event.uid, None)
+        message.reactions = reactions
+
+    def cache_stats(self):
+        """Returns a dict with the hit counters of the bot's caches"""
+        return {
+            'usernames': self._username_cache.stats(),
+            'messages': self._message_cache.stats(),
+        }
 
     def _fbchat_callback_handler(self, func, thread, event):
-        for handler in self._handlers.get(func, []):
+        if self._dedup is not None and self._dedup.seen(func, event):
+            log.debug('Dropping a duplicate %s event', func)
+            return
+        if func in ('onMessage', 'onReactionAdded', 'onReactionRemoved'):
+            # updated before queueing, so handlers always see the latest reactions
+            self._update_message_cache(func, event)
+            if func != 'onMessage':
+                self.reaction_tally.update(func, event)
+        # events from one thread are handled in order, different threads in parallel
+        key = thread.id_ if thread is not None else None
+        self._executor.submit(key, self._dispatch, func, thread, event)
+
+    def _dispatch(self, func, thread, event):
+        for handler in self._dispatcher.candidates(func, event):
+            breaker = self._breakers.get(handler)
+            if breaker is not None and not breaker.allow():
+                continue
+            label = handler_label(handler)
             valid = self._run_untrusted(
                 handler.check,
                 args=[event, self],
-                default='error',
+                handler=handler,
+                default=self._FAILED,
                 thread=thread,
-                notify=False
+                notify=False,
+                metric=('check', label)
             )
-            if valid == 'error':
-                self._handlers.get(event, []).remove(handler)
-                errormsg = f'The handler {handler} was disabled, because of causing an exception.'
-                log.error(errormsg)
-                self.send(
-                    errormsg,
-                    thread=self.owner
+            if valid is self._FAILED:
+                ok = False
+            elif not valid:
+                ok = None
+            else:
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(
+                        'Executing %s, reacting to %s', handler, event,
+                        extra={
+                            'event': func, 'mid': getattr(event, 'mid', None),
+                            'handler': handler, 'fb_thread': thread,
+                        }
+                    )
+                result = self._run_untrusted(
+                    handler.execute,
+                    args=[event, self],
+                handler=handler,
+                    default=self._FAILED,
+                    thread=thread,
+                    metric=('execute', label)
                 )
-            elif valid:
-                log.debug('Executing %s, reacting to %s', handler, event)
-                raise NotImplementedError # FIXME
+                ok = result is not self._FAILED
+            if breaker is not None and breaker.record(ok):
+                self._breaker_changed(handler, breaker)
+
+    def _breaker_changed(self, handler: BaseHandler, breaker: CircuitBreaker):
+        if breaker.state == OPEN:
+            message = (
+                f'The handler {handler} was disabled for {breaker.cooldown}s, '
+                'because of causing exceptions.'
+            )
+            log.error(message)
+        else:
+            message = f'The handler {handler} was enabled again.'
+            log.info(message)
+        self._send_to_owner(message)
 
     def _run_untrusted( # pylint: disable=dangerous-default-value
             self,
             fun,
             args=[],
             kwargs={},
+            handler=None,
             thread=None,
             notify=True,
             default=None,
-            catch_keyboard=False
+            catch_keyboard=False,
+            metric=None
         ):
+        # handler is the handler `fun` belongs to, named in error reports,
+        # metric is a (phase, label) tuple, recorded in self.metrics
+        start = time.perf_counter()
+        error = False
+        token = None
+        if self.watchdog is not None:
+            token = self.watchdog.start(fun if handler is None else handler, thread)
         try:
             return fun(*args, **kwargs)
         except Exception:
-            trace = traceback.format_exc()
-            if thread is not None and notify:
-                short_error_message = \
-                    _("An error occured and the action could not be completed.\n"
-                      "The administrator has been notified.\n") \
-                    + trace.splitlines()[-1]
-                raise NotImplementedError # FIXME
-                self.send(short_error_message, thread) # notify the end user
-            error_message = '\n'.join([
-                f'Error while running function {fun.__name__}',
-                f'with *args={args}',
-                f'**kwargs={kwargs}',
-                f'in thread {thread}',
-                f'Full traceback:',
-                trace,
-            ])
-            log.error(error_message)
-            if self.owner: # Report error to admin
-                raise NotImplementedError # FIXME
+            error = True
+            self._report_error(fun, handler, args, kwargs, thread, notify, sys.exc_info())
             return default
         except KeyboardInterrupt as ex:
             if catch_keyboard:
@@ -209,3 +476,39 @@ class Bot(object):
                     self.send(_('The command has been interrupted by admin'), thread)
                 return default
             raise ex
+        finally:
+            if token is not None:
+                self.watchdog.finish(token)
+            if metric is not None:
+                self.metrics.observe(*metric, time.perf_counter() - start, error)
+
+    def _report_error(self, fun, handler, args, kwargs, thread, notify, exc_info):
+        if thread is not None and notify:
+            short_error_message = \
+                _("An error occured and the action could not be completed.\n"
+                  "The administrator has been notified.\n") \
+                + traceback.format_exception_only(*exc_info[:2])[-1]
+            self.send(short_error_message, thread, coalesce=True, wait=False) # notify the end user
+        if handler is not None:
+            label = handler_label(handler)
+        else:
+            label = getattr(fun, '__qualname__', repr(fun))
+        # repeated errors are only counted, their tracebacks go to the error log
+        first = self._errors.report(label, exc_info, thread)
+        # the traceback and arguments are formatted when the record is written
+        log.error(
+            'Error while running function %s\nwith *args=%s\n**kwargs=%s\nin thread %s',
+            getattr(fun, '__name__', fun), args, kwargs, thread,
+            exc_info=exc_info if first else None,
+            extra={
+                # the event's name, like in dispatch records
+                'event': handler.event if handler is not None else None,
+                'mid': getattr(args[0], 'mid', None) if args else None,
+                'handler': handler,
+                'fb_thread': thread,
+            }
+        )
+
+    def _send_to_owner(self, text):
+        if self.owner is not None:
+            self.send(text, self.owner, wait=False)
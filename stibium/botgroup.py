@@ -0,0 +1,81 @@
+"""
+This module provides running several bots in one process
+
+Every bot in a BotGroup is a separate Messenger account with its own
+handlers, timeouts, outbox and message cache. The worker pool running
+handlers, the scheduler and the cache of user names are shared.
+Logging is configured once for the whole process, see
+stibium.configure_logging.
+"""
+
+import threading
+
+from ._cache import LRUCache
+from ._executor import Executor
+from ._scheduler import Scheduler
+from ._logs import log
+from .bot import Bot
+
+
+class BotGroup(object):
+    """
+    Runs several bots in one process
+
+    Create the bots with `create`, which takes the same arguments
+    as Bot, then call `login` and `listen`.
+    """
+    def __init__(
+            self, workers=8, queue_size=10000,
+            user_cache_size=16384, user_cache_ttl=24*60*60
+        ):
+        self.bots = []
+        self.executor = Executor(workers, queue_size)
+        self.scheduler = Scheduler()
+        self.user_cache = LRUCache(user_cache_size, user_cache_ttl)
+        self._threads = []
+
+    def create(self, *args, bot_class=Bot, **kwargs):
+        """Create a bot using the shared worker pool, scheduler and caches"""
+        bot = bot_class(
+            *args,
+            executor=self.executor,
+            scheduler=self.scheduler,
+            user_cache=self.user_cache,
+            **kwargs
+        )
+        self.bots.append(bot)
+        return bot
+
+    def login(self):
+        """Log in all bots which aren't logged in yet"""
+        for bot in self.bots:
+            if not bot._logged_in: # pylint: disable=protected-access
+                bot.login()
+
+    def listen(self):
+        """Listen for events with all bots, returns when all of them stop"""
+        for bot in self.bots:
+            thread = threading.Thread(
+                target=self._listen, args=(bot,), name=f'ListenThread-{bot.name}', daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    @staticmethod
+    def _listen(bot):
+        try:
+            bot.listen()
+        except Exception: # pylint: disable=broad-except
+            log.exception('Bot %s stopped listening', bot.name)
+
+    def stats(self):
+        """Returns the shared pool's and cache's stats, and every bot's queues"""
+        return {
+            'handlers': self.executor.stats(),
+            'usernames': self.user_cache.stats(),
+            'scheduled': len(self.scheduler),
+            'bots': {bot.name: bot._outbox.stats() for bot in self.bots}, # pylint: disable=protected-access
+        }
@@ -3,22 +3,32 @@ This module contains common example handlers.
 They can be used in bots or be referenced as
 examples of handlers.
 """
-from .echo import EchoCommand
-from .info import InfoCommand
-from .pins import Pins
-from .whereami import WhereAmICommand
-from .forward import Forward
-from .selfdestruct import SelfDestructMessage
-from .everyone import EveryoneCommand
-from .permissions import Permissions
+import importlib
 
-__all__ = [
-    'EchoCommand',
-    'InfoCommand',
-    'Pins',
-    'WhereAmICommand',
-    'Forward',
-    'SelfDestructMessage',
-    'EveryoneCommand',
-    'Permissions',
-]
+# handlers are imported on first access
+_MODULES = {
+    'EchoCommand': '.echo',
+    'InfoCommand': '.info',
+    'Pins': '.pins',
+    'WhereAmICommand': '.whereami',
+    'Forward': '.forward',
+    'SelfDestructMessage': '.selfdestruct',
+    'EveryoneCommand': '.everyone',
+    'Permissions': '.permissions',
+}
+
+__all__ = list(_MODULES)
+
+
+def __getattr__(name):
+    try:
+        module = _MODULES[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULES))
@@ -1,8 +1,23 @@
 """This module provides the EveryoneCommand class"""
+import time
+
 from fbchat import models
 
 from ..dataclasses import Thread
-from ..handlers import CommandHandler
+from ..handlers import BaseHandler, CommandHandler
+
+class _MembersChangedHandler(BaseHandler):
+    """Invalidates the participant cache of an EveryoneCommand"""
+    def __init__(self, command, event):
+        super().__init__(handler=None)
+        self.command = command
+        self.event = event
+    def __repr__(self):
+        return f'<{type(self).__name__} for {self.command!r} on {self.event}>'
+    def check(self, event, bot):
+        return event.get('thread_id') == self.command.group.id_
+    def handlerfn(self, event, bot):
+        self.command.uids = None
 
 class EveryoneCommand(CommandHandler):
     """
@@ -12,31 +27,56 @@ class EveryoneCommand(CommandHandler):
     present in the group. It can be used to demand attention
     from the whole group, for example for important announcements.
     Take note not to overuse it, as it can be annoying.
+
+    Participants of the group are cached for `ttl` seconds, or until
+    someone is added to or removed from the group. In big groups,
+    mentions are split into messages of `chunk_size` mentions.
+    Pass `rate` (see CommandHandler), for example
+    RateLimit(per_thread=(1, 60), notify=True), to limit how often
+    it can be used.
     """
+    alphabet = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
     group = None
-    uids = []
-    def __init__(self, group, command='everyone'):
-        super().__init__(handler=None, command=command)
+    uids = None
+    fetched = 0
+    def __init__(self, group, command='everyone', ttl=60*60, chunk_size=50, rate=None):
+        super().__init__(handler=None, command=command, rate=rate)
         self.group = Thread.from_group_uid(group)
+        self.ttl = ttl
+        self.chunk_size = chunk_size
+    def setup(self, bot):
+        super().setup(bot)
+        self._members_handlers = bot.register(
+            _MembersChangedHandler(self, 'onPeopleAdded'),
+            _MembersChangedHandler(self, 'onPersonRemoved'),
+        )
+    def teardown(self, bot):
+        self._members_handlers.cancel()
     def check(self, event, bot):
         if event.thread != self.group:
             return False
         return super().check(event, bot)
-    def handlerfn(self, message, bot):
-        if not self.uids:
-            self.uids = bot.fbchat_client.\
-                fetchGroupInfo(self.group.id_)[self.group.id_]\
+    def get_participants(self, bot):
+        """Returns the cached uids of the group's participants"""
+        uids = self.uids
+        if uids is None or time.time() - self.fetched > self.ttl:
+            uids = list(
+                bot.fbchat_client.fetchGroupInfo(self.group.id_)[self.group.id_]
                 .participants
-        alphabet = list('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
-        out = ''
-        offset = 0
-        mentions = []
-        for i in self.uids:
-            mentions.append(models.Mention(i, offset=offset, length=2))
-            out = out + '@' + alphabet[offset//3] + ' '
-            offset += 3
-        bot.fbchat_client.send(
-            models.Message(text=out, mentions=mentions),
-            thread_type=self.group.type_,
-            thread_id=self.group.id_
-        )
+            )
+            self.uids = uids
+            self.fetched = time.time()
+        return uids
+    def _mentions(self, uids):
+        """Yields (text, mentions) for every message to be sent"""
+        for start in range(0, len(uids), self.chunk_size):
+            parts = []
+            mentions = []
+            for i, uid in enumerate(uids[start:start+self.chunk_size]):
+                # every mention is 2 characters long, separated by a space
+                mentions.append(models.Mention(uid, offset=3*i, length=2))
+                parts.append('@' + self.alphabet[(start+i) % len(self.alphabet)])
+            yield ' '.join(parts), mentions
+    def handlerfn(self, message, bot):
+        for text, mentions in self._mentions(self.get_participants(bot)):
+            bot.send(text, self.group, mentions=mentions, wait=False)
@@ -34,6 +34,7 @@ class InfoCommand(CommandHandler):
 
     def __init__(self, command='info', options=None):
         super().__init__(handler=None, command=command)
+        self.options = dict(self.options) # the class attribute has the defaults
         if options is not None:
             for k, v in options.items():
                 if k in self.options:
@@ -71,6 +72,12 @@ class InfoCommand(CommandHandler):
             )
 
     def handlerfn(self, message: Message, bot):
+        if self.options['user'] or self.options['owner']:
+            # fetch both names in one request, _get_data will hit the cache
+            uids = [bot.fbchat_client.uid]
+            if bot.owner is not None:
+                uids.append(bot.owner.id_)
+            bot.get_user_names(uids)
         response = []
         for k, v in self.options.items():
             if v:
@@ -1,7 +1,8 @@
 """This module provides the Permissions contrib class"""
 
-import types
+import os
 import json
+import threading
 
 from ..handlers import CommandHandler
 from ..dataclasses import Thread
@@ -14,11 +15,14 @@ class Permissions(object):
     The user set as admin (can be passed an uid or a Thread) will
     have access to a management command (manage_cmd, default 'manage')
     and can add users to groups. Users added to such group, will not
-    have access to commands wrapped by the `block` method.
+    have access to commands wrapped by the `block` method, and only
+    users in a group will have access to commands wrapped by `allow`.
     Groups and users are stored in json format, in a file
-    which path is in `db_file`.
+    which path is in `db_file`. Changes are appended to a log next to it
+    (`db_file` + '.log'), which is merged into `db_file` on startup.
     """
-    _db = {}
+    compact_after = 1000 # log entries
+    _db = None
     _admin = None
     _db_file = None
     _manage_cmd = None
@@ -26,17 +30,65 @@ class Permissions(object):
         self._admin = Thread.from_user_uid(admin).id_
         self._db_file = db_file
         self._manage_cmd = manage_cmd
+        self._lock = threading.Lock()
+        self._rules = {} # handler -> list of (group, allow, notify)
+        self._originals = {} # handler -> (check, execute)
+        self._log = None
+        self._log_entries = 0
         self._load()
 
+    @property
+    def _log_file(self):
+        return self._db_file + '.log'
+
     def _load(self):
-        with open(self._db_file) as fd:
-            self._db = json.load(fd)
+        self._db = {}
+        if os.path.exists(self._db_file):
+            with open(self._db_file) as fd:
+                for group, uids in json.load(fd).items():
+                    self._db[group] = set(uids)
+        if os.path.exists(self._log_file):
+            with open(self._log_file) as fd:
+                for line in fd:
+                    try:
+                        op, group, uid = json.loads(line)
+                    except ValueError:
+                        break # last line cut off by a crash
+                    self._apply(op, group, uid)
+        self._compact()
+
+    def _apply(self, op, group, uid):
+        members = self._db.setdefault(group, set())
+        if op == 'add':
+            members.add(uid)
+        elif op == 'remove':
+            members.discard(uid)
 
-    def _save(self):
-        with open(self._db_file, 'w') as fd:
-            json.dump(self._db, fd)
+    def _compact(self):
+        """Atomically write all groups to db_file, and start a new log"""
+        tmp_file = self._db_file + '.tmp'
+        with open(tmp_file, 'w') as fd:
+            json.dump({g: sorted(uids) for g, uids in self._db.items()}, fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp_file, self._db_file)
+        if self._log is not None:
+            self._log.close()
+        self._log = open(self._log_file, 'w')
+        self._log_entries = 0
 
-    def block(self, group, handler=None, notify=True): #AAAA
+    def _change(self, op, group, uid=None):
+        """Apply a change and append it to the log"""
+        with self._lock:
+            self._apply(op, group, uid)
+            self._log.write(json.dumps([op, group, uid]) + '\n')
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._log_entries += 1
+            if self._log_entries >= self.compact_after:
+                self._compact()
+
+    def block(self, group, handler=None, notify=True):
         """
         Block members of `group` from using a command.
         Can be used as a decorator, if handler=None.
@@ -44,45 +96,64 @@ class Permissions(object):
         will receive a message telling them they can't use
         the command.
         """
+        return self._restrict(group, False, handler, notify)
+
+    def allow(self, group, handler=None, notify=True):
+        """
+        Allow only members of `group` to use a command.
+        If a command is wrapped with `allow` for many groups,
+        members of any of them can use it.
+        Can be used as a decorator, if handler=None.
+        `notify` works like in `block`.
+        """
+        return self._restrict(group, True, handler, notify)
+
+    def _restrict(self, group, allow, handler, notify):
         self._assert_group(group)
-        if not notify:
-            def wrapper(han):
-                oldcheck = han.check
-                def hook(self_, event, bot):
-                    if event.uid in self._db[group]:
-                        return False
-                    return oldcheck(event, bot)
-                setattr(
-                    han,
-                    'check',
-                    types.MethodType(hook, han)
-                )
-                return han
-        else:
-            def wrapper(han):
-                oldexec = han.execute
-                def hook(self_, event, bot):
-                    if event.uid in self._db[group]:
-                        event.reply(_("You can't use this command."))
-                        return
-                    return oldexec(event, bot)
-                setattr(
-                    han,
-                    'execute',
-                    types.MethodType(hook, han)
-                )
-                return han
+        def wrapper(han):
+            self._rules.setdefault(han, []).append((group, allow, notify))
+            self._hook(han)
+            return han
         if handler:
             return wrapper(handler)
         else:
             return wrapper
 
-    #def allow(self, group, handler=None, notify=True): # TODO
+    def _hook(self, han):
+        """
+        (Re)build the check and execute hooks of a handler.
+        All rules of the handler are composed into one test, which
+        uses the group sets directly, so it is only rebuilt when
+        rules are added, and not when group members change.
+        """
+        if han not in self._originals:
+            self._originals[han] = (han.check, han.execute)
+        oldcheck, oldexec = self._originals[han]
+        rules = self._rules[han]
+        allowed = tuple(self._db[g] for g, a, n in rules if a)
+        # a user outside of all allow groups gets a reply if any of them notifies
+        allow_notify = any(n for g, a, n in rules if a)
+        def blocked(notify):
+            groups = tuple(self._db[g] for g, a, n in rules if not a and n == notify)
+            return lambda uid: any(uid in members for members in groups)
+        blocked_silent, blocked_notify = blocked(False), blocked(True)
+        def not_allowed(uid):
+            return bool(allowed) and not any(uid in members for members in allowed)
+        def check(event, bot):
+            if blocked_silent(event.uid) or (not allow_notify and not_allowed(event.uid)):
+                return False
+            return oldcheck(event, bot)
+        def execute(event, bot):
+            if blocked_notify(event.uid) or (allow_notify and not_allowed(event.uid)):
+                event.reply(_("You can't use this command."))
+                return
+            return oldexec(event, bot)
+        han.check = check
+        han.execute = execute
 
     def _assert_group(self, group):
         if group not in self._db:
-            self._db[group] = []
-            self._save()
+            self._change('group', group)
 
     def _manage(self, message, bot):
         if message.uid != self._admin:
@@ -101,15 +172,15 @@ class Permissions(object):
             uid = message.replied_to.uid
         else:
             uid = args[2]
-        self._assert_group(args[1])
         if args[0] in ('add', 'ban'):
-            self._db[args[1]].append(uid)
+            self._assert_group(args[1])
+            self._change('add', args[1], uid)
             message.reply(
                 _('Added {uid} to group {group!r}').format(uid=uid, group=args[1])
             )
         elif args[0] in ('remove', 'unban'):
-            if uid in self._db[args[1]]:
-                self._db[args[1]].remove(uid)
+            if uid in self._db.get(args[1], ()):
+                self._change('remove', args[1], uid)
                 message.reply(
                    _('Removed {uid} from group {group!r}').format(uid=uid, group=args[1])
                 )
@@ -117,7 +188,6 @@ class Permissions(object):
                 message.reply(_('User {uid} was not in group.').format(uid=uid))
         else:
             message.reply(_('Unknown subcommand'))
-        self._save()
 
     def handler(self):
         """Returns a handler which needs to be registered"""
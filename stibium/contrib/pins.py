@@ -1,12 +1,28 @@
 """This module provides the Pins contrib class"""
 
+import os
 import json
 import time
 import datetime
+import shutil
+import sqlite3
+import threading
 
-from ..handlers import CommandHandler, ReactionHandler
-from ..dataclasses import Message, Reaction, MessageReaction
+from ..handlers import CommandHandler, ReactionCountHandler
+from ..dataclasses import Thread, Message, Reaction, MessageReaction
 from .._i18n import _
+from .._logs import log
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pins (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    thread TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    author TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pins_by_thread ON pins (thread, id);
+"""
 
 class Pins(object):
     """
@@ -18,51 +34,144 @@ class Pins(object):
     of a pin by a set amount of reactions.
     Pinned messages can be listed by the "list" command.
     Both commands can be renamed with the `pin_cmd` and `list_cmd` kwargs.
-    Pinned messages are stored in json format at the location
-    specified by `db_file`.
+    Pinned messages are stored in an SQLite database at the location
+    specified by `db_file`, separately for every thread.
+    If `db_file` is a json file used by older versions, its pins are
+    imported once into the thread `import_thread`, which is required
+    then, and the file is kept as a backup with a '.bak' suffix.
 
     This class provides two commands, so it has to be registered as:
     `bot.register(*pins.handlers())`
     """
-    _db = []
+    page_size = 5
+    _db = None
     _db_file = None
     _pin_cmd = None
     _list_cmd = None
     _confirms = 0
-    def __init__(self, db_file, pin_cmd='pin', list_cmd='list', confirms=0):
+    def __init__(self, db_file, pin_cmd='pin', list_cmd='list', confirms=0, import_thread=None):
         self._db_file = db_file
         self._pin_cmd = pin_cmd
         self._list_cmd = list_cmd
         self._confirms = confirms
-        self._load()
+        self._lock = threading.Lock()
+        self._load(import_thread)
+
+    def _load(self, import_thread):
+        if os.path.exists(self._db_file) and os.path.getsize(self._db_file) > 0:
+            with open(self._db_file, 'rb') as fd:
+                legacy = not fd.read(16).startswith(b'SQLite format 3')
+            if legacy:
+                self._import_legacy(import_thread)
+        # handlers are run by many worker threads, access is guarded by the lock
+        self._db = sqlite3.connect(self._db_file, check_same_thread=False)
+        with self._db:
+            self._db.executescript(_SCHEMA)
+
+    def _import_legacy(self, import_thread):
+        """
+        Replace the json file at `db_file` with a database of its pins.
+        They're imported into a temporary database, which replaces
+        the json file only when it's complete, so a failed import
+        is retried on the next start.
+        """
+        if import_thread is None:
+            raise ValueError(
+                f'{self._db_file} is a json file used by older versions, '
+                'pass import_thread to choose the thread its pins belong to'
+            )
+        tmp = self._db_file + '.tmp'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        db = sqlite3.connect(tmp)
+        try:
+            with db:
+                db.executescript(_SCHEMA)
+                n = self._insert_json(db, self._db_file, import_thread)
+        finally:
+            db.close()
+        shutil.copy2(self._db_file, self._db_file + '.bak')
+        os.replace(tmp, self._db_file)
+        log.info('Imported %d pins from %s', n, self._db_file + '.bak')
 
-    def _load(self):
-        with open(self._db_file) as fd:
-            self._db = json.load(fd)
+    def import_json(self, json_file, thread):
+        """
+        Import pins from a json file used by older versions,
+        into the namespace of `thread`. Returns the number of imported pins.
+        """
+        with self._lock, self._db:
+            return self._insert_json(self._db, json_file, thread)
 
-    def _save(self):
-        with open(self._db_file, 'w') as fd:
-            json.dump(self._db, fd)
+    def _insert_json(self, db, json_file, thread):
+        with open(json_file) as fd:
+            pins = json.load(fd)
+        thread = self._namespace(thread)
+        db.executemany(
+            'INSERT INTO pins (thread, timestamp, author, text) VALUES (?, ?, ?, ?)',
+            ((thread, timestamp, author, text) for timestamp, author, text in pins)
+        )
+        return len(pins)
+
+    @staticmethod
+    def _namespace(thread):
+        # pins are always listed for a thread, ones without it would be lost
+        if thread is None:
+            raise ValueError('Pins are stored per thread, pass the thread')
+        if isinstance(thread, Thread):
+            return thread.id_
+        return str(thread)
 
-    def add_pin(self, author, text, timestamp=None):
+    def add_pin(self, author, text, timestamp=None, thread=None):
+        """Pin a message in `thread`, which is required"""
         if timestamp is None:
             timestamp = time.time()
-        self._db.append([timestamp, author, text])
-        self._save()
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT INTO pins (thread, timestamp, author, text) VALUES (?, ?, ?, ?)',
+                (self._namespace(thread), timestamp, author, text)
+            )
+
+    def get_pins(self, thread=None, before=None, limit=None):
+        """
+        Returns a list of (id, timestamp, author, text) tuples, newest first.
+        Pass the id of the last returned pin as `before` to get the next ones.
+        """
+        if limit is None:
+            limit = self.page_size
+        if before is None:
+            before = float('inf')
+        with self._lock:
+            return self._db.execute(
+                'SELECT id, timestamp, author, text FROM pins'
+                ' WHERE thread = ? AND id < ? ORDER BY id DESC LIMIT ?',
+                (self._namespace(thread), before, limit)
+            ).fetchall()
 
     def _format_pin(self, pin):
         timestamp = datetime.datetime\
-            .fromtimestamp(pin[0]).strftime('%Y-%m-%d')
+            .fromtimestamp(pin[1]).strftime('%Y-%m-%d')
         out = '\n'.join([
-            f'{pin[1]}, {timestamp}',
+            f'{pin[2]}, {timestamp}',
             f'===',
-            f'{pin[2]}',
+            f'{pin[3]}',
         ])
         return out
 
-    def get_page(self, n):
+    def get_page(self, n, thread=None):
+        if n < 1:
+            return ''
+        # page numbers are turned into a cursor by skipping
+        # over the (thread, id) index, pins are only read for the page
+        with self._lock:
+            cursor = self._db.execute(
+                'SELECT id FROM pins WHERE thread = ?'
+                ' ORDER BY id DESC LIMIT 1 OFFSET ?',
+                (self._namespace(thread), self.page_size*(n-1))
+            ).fetchone()
+        if cursor is None:
+            return ''
         pins = []
-        for pin in self._db[::-1][5*(n-1):5*n]:
+        for pin in self.get_pins(thread, before=cursor[0]+1):
             pins.append(self._format_pin(pin))
         return '\n\n'.join(pins)
 
@@ -71,7 +180,7 @@ class Pins(object):
             n = int(message.args)
         else:
             n = 1
-        message.reply(self.get_page(n))
+        message.reply(self.get_page(n, message.thread))
 
     def _pin_fn(self, message: Message, bot):
         if message.args:
@@ -86,7 +195,7 @@ class Pins(object):
             message.reply(_('Please provide text or reply to a message to be pinned'))
             return
         if self._confirms == 0:
-            self.add_pin(author, text, timestamp)
+            self.add_pin(author, text, timestamp, message.thread)
             message.reply(_('Message was pinned!'))
         else:
             mid = message.reply(
@@ -95,13 +204,9 @@ class Pins(object):
                 MessageReaction.YES.value
                 )
             def _callback(reaction: Reaction, bot):
-                reactions = reaction.message.reactions
-                if len( # count YES reactions
-                        [k for k, v in reactions.items() if v == MessageReaction.YES]
-                    ) == self._confirms:
-                    self.add_pin(author, text, timestamp)
-                    message.reply(_('Message was pinned!'))
-            bot.register(ReactionHandler(_callback, mid, timeout=120))
+                self.add_pin(author, text, timestamp, message.thread)
+                message.reply(_('Message was pinned!'))
+            bot.register(ReactionCountHandler(_callback, mid, self._confirms, timeout=120))
 
     def handlers(self):
         """Returns a list of handlers that need to be registered"""
@@ -48,7 +48,8 @@ class Message(object):
     """Class for received messages"""
     mid = attr.ib()
     text = attr.ib()
-    args = attr.ib(init=False)
+    command = attr.ib(init=False, default=None)
+    args = attr.ib(init=False, default=None)
     uid = attr.ib()
     thread = attr.ib()
     replied_to = attr.ib()
@@ -82,14 +83,17 @@ class Message(object):
         """Create a Message class from fbchat.models.Message"""
         if model is None:
             return None
+        replied_to = cls.from_model(model.replied_to, thread, bot)
+        if replied_to is None and getattr(model, 'reply_to_id', None) and bot is not None:
+            replied_to = bot.cached_message(model.reply_to_id)
         return cls(
             text=model.text,
             uid=model.author,
             mid=model.uid,
             thread=thread,
-            replied_to=cls.from_model(model.replied_to, thread, bot),
+            replied_to=replied_to,
             timestamp=float(model.timestamp)/1000,
-            reactions=model.reactions,
+            reactions=dict(model.reactions or {}), # updated by the bot's message cache
             raw=raw,
             bot=bot,
         )
@@ -117,9 +121,7 @@ class Reaction(object):
     @property
     def message(self):
         if self._message is None:
-            self._message = Message.from_mid(
-                self.mid, self.thread, self.bot
-            )
+            self._message = self.bot.get_message(self.mid, self.thread)
         return self._message
 
     @classmethod
@@ -127,7 +129,7 @@ class Reaction(object):
         """Create a Reaction class from a handler's kwargs"""
         return cls(
             mid=kwargs['mid'],
-            reaction=kwargs['reaction'],
+            reaction=kwargs.get('reaction'), # not passed to onReactionRemoved
             uid=kwargs['author_id'],
             thread=Thread.fromkwargs(kwargs),
             raw=kwargs,
@@ -0,0 +1,138 @@
+"""
+This module provides recording and replaying of received events
+
+Events are stored one per line, as JSON, in the order they were
+received, together with the time they were received at.
+Files with a name ending with '.gz' are compressed.
+"""
+
+import enum
+import gzip
+import json
+import threading
+import time
+
+from fbchat import models
+
+from ._fbclient import EVENTS, handle_event
+from ._logs import log
+
+# fields of fbchat.models.Message kept in the log
+_MESSAGE_FIELDS = ('uid', 'author', 'text', 'timestamp', 'reply_to_id', 'reactions', 'replied_to', 'mentions')
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def encode(value):
+    """Convert an fbchat callback value into JSON-compatible data"""
+    if isinstance(value, enum.Enum):
+        return {'$enum': type(value).__name__, 'name': value.name}
+    if isinstance(value, models.Message):
+        return {'$message': {f: encode(getattr(value, f, None)) for f in _MESSAGE_FIELDS}}
+    if isinstance(value, models.Mention):
+        return {'$mention': [value.thread_id, value.offset, value.length]}
+    if isinstance(value, dict):
+        return {str(k): encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [encode(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return {'$repr': repr(value)}
+
+
+def decode(value):
+    """Convert data created by `encode` back into fbchat objects"""
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if '$enum' in value:
+        return getattr(models, value['$enum'])[value['name']]
+    if '$message' in value:
+        fields = {k: decode(v) for k, v in value['$message'].items()}
+        message = models.Message(text=fields.pop('text'))
+        for k, v in fields.items():
+            setattr(message, k, v)
+        if message.mentions is None:
+            message.mentions = []
+        return message
+    if '$mention' in value:
+        thread_id, offset, length = value['$mention']
+        return models.Mention(thread_id, offset=offset, length=length)
+    if '$repr' in value:
+        return value['$repr']
+    return {k: decode(v) for k, v in value.items()}
+
+
+class EventRecorder(object):
+    """
+    Appends received events to a file
+
+    Pass it to the bot's login as `recorder`. If `raw` is False,
+    the raw `msg` and `metadata` payloads are left out,
+    which makes the log several times smaller.
+    """
+    def __init__(self, path, raw=False):
+        self.path = path
+        self.raw = raw
+        self.recorded = 0
+        self._fd = _open(path, 'a')
+        self._lock = threading.Lock()
+
+    def record(self, func, kwargs):
+        """Append an event to the log"""
+        if not self.raw:
+            kwargs = {k: v for k, v in kwargs.items() if k not in ('msg', 'metadata')}
+        line = json.dumps(
+            {'t': time.time(), 'func': func, 'kwargs': encode(kwargs)},
+            separators=(',', ':'), ensure_ascii=False
+        )
+        with self._lock:
+            self._fd.write(line + '\n')
+            self._fd.flush()
+            self.recorded += 1
+
+    def close(self):
+        with self._lock:
+            self._fd.close()
+
+
+def read_events(path):
+    """Yields (time, func, kwargs) for every event in a log"""
+    with _open(path, 'r') as fd:
+        for line in fd:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                log.warning('Skipping a broken line in %s', path)
+                continue
+            yield entry['t'], entry['func'], decode(entry['kwargs'])
+
+
+def replay(bot, path, speed=1.0):
+    """
+    Feed events from a log into a bot.
+
+    With speed=1.0 the events are passed with the same time between them
+    as when they were recorded, speed=2.0 is twice as fast, and so on.
+    With speed=None they are passed as fast as possible.
+    Returns the number of replayed events.
+    """
+    count = 0
+    start = None
+    for recorded, func, kwargs in read_events(path):
+        if func not in EVENTS:
+            continue
+        if speed is not None:
+            if start is None:
+                start = (recorded, time.monotonic())
+            delay = (recorded - start[0]) / speed - (time.monotonic() - start[1])
+            if delay > 0:
+                time.sleep(delay)
+        handle_event(bot, func, kwargs)
+        count += 1
+    return count
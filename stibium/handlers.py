@@ -1,27 +1,52 @@
 """This module provides the classes for creating event handlers"""
 
 import re
-from .dataclasses import Message, Reaction
+from typing import TYPE_CHECKING
 from ._i18n import _
+from ._flood import RateLimit
+
+if TYPE_CHECKING: # not imported at runtime, to keep fbchat out of the import
+    from .dataclasses import Message, Reaction
 
 #pylint: disable=missing-docstring
 
+# functions of handlers with process=True, by (module, qualified name),
+# looked up by the process pool after importing the module
+process_functions = {}
+
 #### Base handler
 
 class BaseHandler(object):
-    """Base class for creating event handlers"""
+    """
+    Base class for creating event handlers
+
+    If `process` is True, handlerfn is run in the bot's process pool,
+    see Bot.run_in_process. It's found there by its name, so it has
+    to be a function defined at the top level of an importable module
+    (directly, or decorated with a handler's `create`). A handlerfn
+    defined as a method of a subclass can't be used, the handler
+    is rejected when it's registered.
+    """
     event = None
     timeout = None
     handlerfn = None
-    def __init__(self, handler=None, timeout=None):
+    process = False
+    registration = None # set by Bot.register
+    def __init__(self, handler=None, timeout=None, process=None):
         self.timeout = timeout
+        if process is not None:
+            self.process = process
         # Note: self.handlerfn is supposed to be
         # defined in custom subclass-based commands,
         # "None" should be then passed to this __init__.
         if handler is not None:
             self.handlerfn = handler
+            if self.process:
+                process_functions[(handler.__module__, handler.__qualname__)] = handler
     def setup(self, bot):
         pass
+    def teardown(self, bot):
+        pass
     def check(self, event, bot):
         return False
     def execute(self, event, bot):
@@ -30,7 +55,11 @@ class BaseHandler(object):
             # with positional parameters, in order to
             # let 'event' be renamed to a more fitting name
             # (like Message for onMessage handlers)
-            self.handlerfn(event, bot)
+            # With AsyncBot, handlerfn can also be an `async def`,
+            # the returned coroutine is awaited by the bot.
+            if self.process:
+                return bot.run_in_process(self.handlerfn, event)
+            return self.handlerfn(event, bot)
 
 #### Generic handlers
 
@@ -44,50 +73,74 @@ class CommandHandler(BaseHandler):
     Example commands:
     !echo test (the prefix is "!", command is "echo", args is "test")
     %help (prefix is "%", command is "help, args is "")
+
+    `rate` limits how often the command can be used, it's either
+    a RateLimit or a (count, seconds) tuple, limiting every user
+    to `count` uses in `seconds`. Without it, the bot's
+    `command_rate` applies.
     """
     event = 'onMessage'
     command = None
+    key = None
     prefix = None
     regex = None
     timeout = None
     wait = False
-    def __init__(self, handler, command, wait=False, timeout=None):
-        super().__init__(handler=handler, timeout=timeout)
+    rate = None
+    _limit = None
+    def __init__(self, handler, command, wait=False, timeout=None, rate=None, process=None):
+        super().__init__(handler=handler, timeout=timeout, process=process)
         self.command = command
         self.wait = wait
+        self.rate = RateLimit.from_rate(rate)
     def __repr__(self):
         return f'<{type(self).__name__} for {repr(self.command)}>'
     def setup(self, bot):
         self.prefix = bot.prefix
+        self._limit = self.rate if self.rate is not None else getattr(bot, 'command_rate', None)
+        # plain command names are looked up by the bot's dispatcher,
+        # anything else is matched with the regex below
+        if re.escape(self.command) == self.command:
+            self.key = self.command.lower()
         # regex for: (assumng prefix=%)
         # %command [args] # or
         # % command [args]
         # with command being case-insensitive
         self.regex = re.compile(
-            r'^{prefix}\s?{command}($|\s(?P<args>.+))$'.format(
-                prefix=self.prefix, command=self.command
+            r'^{prefix}\s?(?:{command})($|\s(?P<args>.+))$'.format(
+                prefix=re.escape(self.prefix), command=self.command
             ),
             re.IGNORECASE
         )
-    def check(self, event: Message, bot):
+    def check(self, event: 'Message', bot):
         if event.text is None:
             return False
-        match = self.regex.match(event.text)
-        if match is None:
-            return False
+        if self.key is not None and event.command is not None:
+            # the message was already parsed by the dispatcher
+            if event.command != self.key:
+                return False
+        else:
+            match = self.regex.match(event.text)
+            if match is None:
+                return False
+            # parse out args for easier processing
+            event.args = match.group('args') or ''
+        if self._limit is not None:
+            return self._limit.allow(self.command, event)
         return True
-    def execute(self, event: Message, bot):
-        match = self.regex.match(event.text)
-        # parse out args for easier processing
-        args = match.group('args') or ''
-        event.args = args
+    def execute(self, event: 'Message', bot):
+        if event.args is None: # not checked before executing
+            event.args = self.regex.match(event.text).group('args') or ''
         if self.wait:
             event.reply(_('Please wait...'))
-        super().execute(event, bot)
+        return super().execute(event, bot)
     @classmethod
-    def create(cls, command, timeout=None, wait=False):
+    def create(cls, command, timeout=None, wait=False, rate=None, process=None):
         def wrapper(fun):
-            return cls(command=command, handler=fun, wait=wait, timeout=timeout)
+            return cls(
+                command=command, handler=fun, wait=wait,
+                timeout=timeout, rate=rate, process=process
+            )
         return wrapper
 
 class ReactionHandler(BaseHandler):
@@ -106,11 +159,9 @@ class ReactionHandler(BaseHandler):
     def __repr__(self):
         return f'<{type(self).__name__} mid={repr(self.mid)}>'
     def setup(self, bot):
-        if isinstance(self.mid, Message):
-            self.mid = self.mid.mid
-        else:
-            self.mid = str(self.mid)
-    def check(self, event: Reaction, bot):
+        # a Message object or a message id
+        self.mid = str(getattr(self.mid, 'mid', self.mid))
+    def check(self, event: 'Reaction', bot):
         if event.mid == self.mid:
             return True
         return False
@@ -120,6 +171,48 @@ class ReactionHandler(BaseHandler):
             return cls(handler=fun, mid=mid, timeout=timeout)
         return wrapper
 
+class ReactionCountHandler(ReactionHandler):
+    """
+    Event handler for reaching a number of reactions
+
+    Handlers created from this class are executed once, when the message
+    gets `count` reactions of the `reaction` type (MessageReaction.YES
+    if None).
+    Reactions are counted by the bot as they arrive, so this
+    doesn't need to fetch the message.
+    """
+    count = None
+    reaction = None
+    done = False
+    def __init__(self, handler, mid, count, reaction=None, timeout=None):
+        super().__init__(handler=handler, mid=mid, timeout=timeout)
+        self.count = count
+        self.reaction = reaction
+    def __repr__(self):
+        return f'<{type(self).__name__} mid={repr(self.mid)} count={self.count}>'
+    def setup(self, bot):
+        super().setup(bot)
+        if self.reaction is None:
+            from .dataclasses import MessageReaction # pylint: disable=import-outside-toplevel
+            self.reaction = MessageReaction.YES
+        message = bot.cached_message(self.mid)
+        bot.reaction_tally.watch(self.mid, message.reactions if message else None)
+    def teardown(self, bot):
+        bot.reaction_tally.unwatch(self.mid)
+    def check(self, event: 'Reaction', bot):
+        if self.done or event.mid != self.mid:
+            return False
+        return bot.reaction_tally.count(self.mid, self.reaction) >= self.count
+    def execute(self, event: 'Reaction', bot):
+        self.done = True
+        bot.unregister(self)
+        return super().execute(event, bot)
+    @classmethod
+    def create(cls, mid, count, reaction=None, timeout=None):
+        def wrapper(fun):
+            return cls(handler=fun, mid=mid, count=count, reaction=reaction, timeout=timeout)
+        return wrapper
+
 class TimeoutHandler(BaseHandler):
     """
     Event handler for timeouts
@@ -132,9 +225,6 @@ class TimeoutHandler(BaseHandler):
         if timeout is None:
             raise Exception(f'Timeout for {type(self).__name__} not provided')
         super().__init__(handler=handler, timeout=timeout)
-    def execute(self, event, bot):
-        if callable(self.handlerfn):
-            self.handlerfn(event, bot)
     @classmethod
     def create(cls, timeout):
         def wrapper(fun):
@@ -0,0 +1,194 @@
+"""
+This module provides the metrics collected by the bot
+
+Every bot has a `metrics` attribute with a Metrics object. It counts
+calls and errors, and measures latency of handler checks and
+executions, timeout and recurrent handlers, and sent messages.
+Queue depths and cache hit rates are read from the bot when
+the metrics are exported.
+"""
+
+import bisect
+import os
+import threading
+
+from ._logs import log
+
+# latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def handler_label(handler):
+    """
+    Returns a name for a handler, used as its label.
+    Handlers created for every use (like confirmation ReactionHandlers)
+    get the same label, so the number of labels stays bounded.
+    """
+    name = type(handler).__name__
+    detail = getattr(handler, 'command', None)
+    if detail is None:
+        detail = getattr(handler.handlerfn, '__qualname__', None)
+    if detail is None:
+        return name
+    return f'{name}:{detail}'
+
+
+class Histogram(object):
+    """Latency histogram with fixed buckets"""
+    __slots__ = ('counts', 'sum', 'count')
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket containing the quantile"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+class CallStats(object):
+    """Calls, errors and latency of one phase of one handler"""
+    __slots__ = ('calls', 'errors', 'latency')
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'latency_sum': self.latency.sum,
+            'latency_p50': self.latency.quantile(0.5),
+            'latency_p99': self.latency.quantile(0.99),
+        }
+
+
+class Metrics(object):
+    """
+    Registry of the bot's metrics
+
+    `observe` is called by the bot, `snapshot` returns all metrics
+    as a dict, and `prometheus` in the Prometheus text format,
+    which can also be written to a file or served over HTTP.
+    """
+    def __init__(self):
+        self._stats = {} # (phase, label) -> CallStats
+        self._gauges = {} # name -> function returning a (nested) dict of numbers
+        self._lock = threading.Lock()
+
+    def observe(self, phase, label, seconds, error=False):
+        """Record a call of `phase` ('check', 'execute', 'send'...) for `label`"""
+        with self._lock:
+            stats = self._stats.get((phase, label))
+            if stats is None:
+                stats = self._stats[(phase, label)] = CallStats()
+            stats.calls += 1
+            if error:
+                stats.errors += 1
+            stats.latency.observe(seconds)
+
+    def add_gauges(self, name, fn):
+        """Add a function returning a dict of values read when exporting"""
+        self._gauges[name] = fn
+
+    def stats(self, phase, label):
+        """Returns the CallStats for a phase and label, or None"""
+        return self._stats.get((phase, label))
+
+    def _gauge_values(self):
+        values = {}
+        def flatten(prefix, value):
+            if isinstance(value, dict):
+                for k, v in value.items():
+                    flatten(f'{prefix}_{k}', v)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                values[prefix] = value
+        for name, fn in self._gauges.items():
+            try:
+                flatten(name, fn())
+            except Exception: # pylint: disable=broad-except
+                log.exception('Could not read the %s metrics', name)
+        return values
+
+    def snapshot(self):
+        """Returns all metrics as a dict"""
+        with self._lock:
+            calls = {}
+            for (phase, label), stats in self._stats.items():
+                calls.setdefault(label, {})[phase] = stats.as_dict()
+        return {
+            'handlers': calls,
+            'gauges': self._gauge_values(),
+        }
+
+    def prometheus(self):
+        """Returns all metrics in the Prometheus text format"""
+        lines = []
+        with self._lock:
+            items = sorted(self._stats.items())
+            lines.append('# TYPE stibium_calls_total counter')
+            for (phase, label), stats in items:
+                lines.append(f'stibium_calls_total{{{_labels(phase, label)}}} {stats.calls}')
+            lines.append('# TYPE stibium_errors_total counter')
+            for (phase, label), stats in items:
+                lines.append(f'stibium_errors_total{{{_labels(phase, label)}}} {stats.errors}')
+            lines.append('# TYPE stibium_latency_seconds histogram')
+            for (phase, label), stats in items:
+                labels = _labels(phase, label)
+                total = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), stats.latency.counts):
+                    total += count
+                    lines.append(f'stibium_latency_seconds_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f'stibium_latency_seconds_sum{{{labels}}} {stats.latency.sum}')
+                lines.append(f'stibium_latency_seconds_count{{{labels}}} {stats.latency.count}')
+        for name, value in sorted(self._gauge_values().items()):
+            lines.append(f'# TYPE stibium_{name} gauge')
+            lines.append(f'stibium_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Atomically write the metrics in the Prometheus text format to a file"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as fd:
+            fd.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve the metrics over HTTP in a background thread, returns the server"""
+        import http.server # pylint: disable=import-outside-toplevel
+        metrics = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self): # pylint: disable=invalid-name
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                log.debug('Metrics request: ' + format, *args)
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(
+            target=server.serve_forever, name='MetricsThread', daemon=True
+        ).start()
+        log.info('Serving metrics on http://%s:%d/', host, server.server_port)
+        return server
+
+
+def _labels(phase, label):
+    label = label.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'phase="{phase}",handler="{label}"'